@@ -1,12 +1,53 @@
-from flask import Flask, request, session, redirect, url_for, render_template, flash
+from flask import (
+    Flask,
+    Response,
+    abort,
+    flash,
+    jsonify,
+    make_response,
+    redirect,
+    render_template,
+    request,
+    session,
+    url_for,
+)
 from flask_dance.contrib.google import make_google_blueprint, google  # type: ignore
 import os
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from werkzeug.middleware.proxy_fix import ProxyFix
-from .auth import make_authorized_request
+from .auth import make_authorized_request, get_token, token_is_warm, get_circuit_breaker, GatewayError
 from .countries import countries_list as countries
+from .utils.http_caching import register_http_caching, weak_etag
+from .utils.templating import register_template_cache, render_listing
+from .utils.profiling import Profiler, phase, register_profiling
+from .utils.memory import MemoryAccounting, register_memory_accounting
+from .utils.tracing import Tracer, register_tracing, span
+from .utils.prefetch import Prefetcher, register_prefetching
+from .services.city_index import PrefixIndex
+from .services.city_views import CityViews
+from .services.nearby_cities import CityGrid, merge_by_date
+from .services.event_index import EventSearchIndex
+from .services.catalog_snapshot import CatalogSnapshot
+from .services.sales_dashboard import VenueDashboard
+from .services.exports import csv_rows, ics_lines, iter_pages
+from .services.bulk_events import BulkOperationError, apply_bulk, parse_params
+from .services.tickets import TicketRenderer, document_key, ticket_key
+from .services.idempotency import IdempotencyStore, derive_key
+from .services.purchase_queue import PurchaseQueue, CONFIRMED
+from .services.waiting_room import WaitingRoom, ADMITTED, QUEUED, REJECTED
+from .utils.circuit_breaker import OPEN
+from .utils.refreshing_cache import RefreshingCache
+from .utils.cache import shared_cache
 from datetime import datetime
+from itertools import islice
+from itsdangerous import URLSafeSerializer
 import bleach  # type: ignore
+import contextvars
+import re
+import requests
+import secrets
+import tempfile
 
 # FLASK SETUP #
 app = Flask(__name__)
@@ -14,6 +55,32 @@ app.secret_key = os.environ.get("FLASK_SECRET_KEY", "klasdnaslkdalaklsdnasfjao")
 app.config["SESSION_COOKIE_SECURE"] = True
 app.config["PREFERRED_URL_SCHEME"] = "https"
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1)  # type: ignore
+register_http_caching(app)
+register_template_cache(app)
+profiler = Profiler(
+    slow_ms=float(os.environ.get("SLOW_REQUEST_MS", "1000")),
+    interval=float(os.environ.get("PROFILER_INTERVAL_MS", "5")) / 1000,
+)
+register_profiling(app, profiler)
+PROFILER_MAX_SECONDS = 300
+memory_accounting = MemoryAccounting(
+    sample_rate=float(os.environ.get("MEMORY_SAMPLE_RATE", "0.05")),
+    session_budget=int(os.environ.get("SESSION_BUDGET_BYTES", "3800")),
+    session_action=os.environ.get("SESSION_BUDGET_ACTION", "log"),
+)
+register_memory_accounting(app, memory_accounting)
+tracer = Tracer(
+    max_traces=int(os.environ.get("TRACE_BUFFER_SIZE", "500")),
+    path=os.environ.get("TRACE_FILE"),
+)
+register_tracing(app, tracer)
+prefetcher = Prefetcher(
+    max_workers=int(os.environ.get("PREFETCH_WORKERS", "2")),
+    max_pending=int(os.environ.get("PREFETCH_MAX_PENDING", "20")),
+    per_minute=int(os.environ.get("PREFETCH_PER_MINUTE", "60")),
+    max_foreground=int(os.environ.get("PREFETCH_MAX_FOREGROUND", "8")),
+)
+register_prefetching(app, prefetcher)
 
 
 # GOOGLE AUTH SETUP #
@@ -63,15 +130,255 @@ def one_user_type_allowed(user_type):
     return decorator
 
 
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # Admin endpoints are disabled unless ADMIN_TOKEN is set
+        admin_token = os.environ.get("ADMIN_TOKEN")
+        if not admin_token or request.headers.get("Authorization") != f"Bearer {admin_token}":
+            return jsonify({"error": "Forbidden"}), 403
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def sanitize(value):
+    with span("sanitize"):
+        return bleach.clean(value)
+
+
+def google_userinfo():
+    with phase("google"), span("google.get", path="/oauth2/v2/userinfo"):
+        return google.get("/oauth2/v2/userinfo")
+
+
 def save_user_session_data(account_info_json):
     session["profile_picture"] = account_info_json.get("picture", "")
 
 
+waiting_room = WaitingRoom(
+    os.environ.get("WAITING_ROOM_PATH", os.path.join(tempfile.gettempdir(), "jumpstart-waiting-room.sqlite3")),
+    capacity=int(os.environ.get("WAITING_ROOM_CAPACITY", "50")),
+    admission_ttl=int(os.environ.get("WAITING_ROOM_ADMISSION_TTL", "600")),
+    queue_ttl=int(os.environ.get("WAITING_ROOM_QUEUE_TTL", "60")),
+    max_queued=int(os.environ.get("WAITING_ROOM_MAX_QUEUED", "5000")),
+)
+CHECKOUT_RETRY_AFTER = int(os.environ.get("CHECKOUT_RETRY_AFTER", "30"))
+
+
+def checkout_overloaded():
+    # No point admitting buyers while reservations can't reach the gateway
+    return get_circuit_breaker("/reserve_tickets").state == OPEN
+
+
+def overloaded_response():
+    response = make_response(
+        render_template("waiting_room.html", overloaded=True, retry_after=CHECKOUT_RETRY_AFTER), 503
+    )
+    response.headers["Retry-After"] = str(CHECKOUT_RETRY_AFTER)
+    return response
+
+
+idempotency = IdempotencyStore(shared_cache, ttl=int(os.environ.get("IDEMPOTENCY_TTL", "86400")))
+IDEMPOTENCY_KEY = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+# "sync" confirms a purchase within the request, "async" queues it and shows a pending status
+PURCHASE_CONFIRMATION = os.environ.get("PURCHASE_CONFIRMATION", "sync")
+
+
+def request_idempotency_key():
+    key = request.form.get("idempotency_key") or request.headers.get("Idempotency-Key") or ""
+    return key if IDEMPOTENCY_KEY.match(key) else secrets.token_urlsafe(16)
+
+
+def idempotent_request(scope, key, endpoint_path, body):
+    """make_authorized_request at most once per key, repeats get the stored (status_code, content, replayed)"""
+
+    def call():
+        try:
+            return make_authorized_request(endpoint_path, body)
+        except requests.RequestException as e:
+            # Timed out or dropped: it may or may not have gone through, retry with the same key
+            return 503, str(e)
+
+    return idempotency.run(scope, key, call)
+
+
+def send_purchase(purchase):
+    return idempotent_request("purchase", purchase["idempotency_key"], "/purchase_tickets", purchase["request"])
+
+
+def record_purchase(purchase):
+    shared_cache.delete(f"tickets:{purchase['user_id']}")
+    dashboard = venue_dashboards.peek(purchase.get("venue_id"))
+    if dashboard is not None:
+        dashboard.record_purchase(purchase["event_id"], len(purchase["request"]["ticket_ids"]))
+
+
+def settle_purchase(purchase, status):
+    if status == CONFIRMED:
+        record_purchase(purchase)
+
+
+purchase_queue = PurchaseQueue(
+    os.environ.get("PURCHASE_QUEUE_PATH", os.path.join(tempfile.gettempdir(), "jumpstart-purchases.sqlite3")),
+    send=send_purchase,
+    on_result=settle_purchase,
+    batch_size=int(os.environ.get("PURCHASE_BATCH_SIZE", "20")),
+    interval=float(os.environ.get("PURCHASE_FLUSH_INTERVAL", "1")),
+)
+
+
+catalog_snapshot = CatalogSnapshot(
+    os.environ.get("CATALOG_SNAPSHOT_DIR", os.path.join(tempfile.gettempdir(), "jumpstart-catalog")),
+    min_interval=int(os.environ.get("CATALOG_SNAPSHOT_INTERVAL", "60")),
+)
+
+
+CATALOG_TTLS = {
+    "cities": int(os.environ.get("CACHE_CITIES_TTL", "3600")),
+    "events": int(os.environ.get("CACHE_EVENTS_TTL", "60")),
+    "coordinates": int(os.environ.get("CACHE_COORDINATES_TTL", "86400")),
+}
+ACCOUNT_INFO_TTL = int(os.environ.get("CACHE_ACCOUNT_INFO_TTL", "300"))
+
+
+def fetch_catalog(kind, key, endpoint_path, req, refresh=False):
+    """Fetches catalog data through the shared cache, falling back to the last good
+    snapshot when the gateway is down or its circuit is open. Returns (data, stale).
+    refresh skips the cache and replaces the cached entry."""
+
+    def fetch():
+        try:
+            status_code, resp_content = make_authorized_request(endpoint_path, req)
+        except requests.RequestException as e:
+            raise GatewayError(503, str(e))
+        if status_code != 200:
+            raise GatewayError(status_code, resp_content)
+        data = resp_content.get("message").get("data")
+        catalog_snapshot.save(kind, key, data)
+        return data
+
+    try:
+        if refresh:
+            data = fetch()
+            shared_cache.set(f"{kind}:{key}", data, CATALOG_TTLS[kind])
+            return data, False
+        return shared_cache.get_or_compute(f"{kind}:{key}", fetch, CATALOG_TTLS[kind]), False
+    except GatewayError as e:
+        if e.status_code >= 500:
+            data = catalog_snapshot.load(kind, key)
+            if data is not None:
+                return data, True
+        raise
+
+
+def fetch_cities(country):
+    req = {"function": "get", "object_type": "city", "identifier": country}
+    return fetch_catalog("cities", country, "/get_cities_by_country", req)
+
+
+known_countries = frozenset(countries)
+city_index = RefreshingCache(
+    lambda country: PrefixIndex(*fetch_cities(country)),
+    max_age=int(os.environ.get("CITY_INDEX_MAX_AGE", "3600")),
+)
+
+
+def known_city(city):
+    """Whether city is one of the session country's cities. Every new city costs a
+    gateway call, an event index and a snapshot file, so only real ones are looked up"""
+    country = session.get("country")
+    if country not in known_countries:
+        return False
+    try:
+        return city in city_index.get(country)
+    except GatewayError:
+        return False
+
+
+def fetch_city_events(city, refresh=False):
+    req = {"function": "get", "object_type": "event", "identifier": city}
+    return fetch_catalog("events", city, "/get_events_in_city", req, refresh=refresh)
+
+
+def fetch_city_coordinates(country):
+    # /get_city_coordinates is assumed, the baseline gateway client has no call returning coordinates
+    req = {"function": "get", "object_type": "city", "identifier": country}
+    return fetch_catalog("coordinates", country, "/get_city_coordinates", req)
+
+
+city_grids = RefreshingCache(
+    lambda country: CityGrid(*fetch_city_coordinates(country)),
+    max_age=int(os.environ.get("CITY_GRID_MAX_AGE", "86400")),
+)
+
+
+# Matches items_per_page in events.html
+LISTING_PAGE_SIZE = 20
+PREFETCH_REFRESH_WINDOW = int(os.environ.get("PREFETCH_REFRESH_WINDOW", "30"))
+PREFETCH_TOP_CITIES = int(os.environ.get("PREFETCH_TOP_CITIES", "3"))
+city_views = CityViews()
+
+
+def warm_city_events(city):
+    """Fetches a city's events unless they're cached for a while yet"""
+    expires_in = shared_cache.expires_in(f"events:{city}")
+    if expires_in is None or expires_in < PREFETCH_REFRESH_WINDOW:
+        fetch_city_events(city, refresh=True)
+
+
+def prefetch_next_page(city, n_events, stale):
+    # The whole list is fetched for every page, so keep it cached for the next click
+    page = request.args.get("page", 1, type=int)
+    if not stale and page * LISTING_PAGE_SIZE < n_events:
+        prefetcher.submit(f"events:{city}", warm_city_events, city)
+
+
+def prefetch_popular_cities(country):
+    for city in city_views.top(country, PREFETCH_TOP_CITIES):
+        prefetcher.submit(f"events:{city}", warm_city_events, city)
+
+
+event_indexes = RefreshingCache(
+    lambda city: EventSearchIndex(*fetch_city_events(city)),
+    max_age=int(os.environ.get("EVENT_INDEX_MAX_AGE", "300")),
+    max_entries=int(os.environ.get("EVENT_INDEX_MAX_ENTRIES", "500")),
+)
+
+
+def annotate_event_dates(events, sort=True):
+    """Adds display date and time to each event, parsing every timestamp once"""
+    with phase("parse"):
+        parsed = [(datetime.fromisoformat(event["date_time"]), event) for event in events]
+        if sort:
+            parsed.sort(key=lambda pair: pair[0])
+        for dt_object, event in parsed:
+            event["date"] = dt_object.date()
+            event["time"] = dt_object.strftime("%H:%M")
+        return [event for _, event in parsed]
+
+
+def fetch_venue_events(venue_id):
+    req = {"function": "get", "object_type": "event", "identifier": venue_id}
+    status_code, event_data = make_authorized_request("/get_events_for_venue", req)
+    if status_code != 200:
+        raise GatewayError(status_code, event_data)
+    return event_data.get("message").get("data")
+
+
+# Built once per venue, then kept current by the reserve, purchase, create and delete routes
+venue_dashboards = RefreshingCache(
+    lambda venue_id: VenueDashboard(fetch_venue_events(venue_id)),
+    max_age=int(os.environ.get("DASHBOARD_MAX_AGE", "900")),
+)
+
+
 # ROUTES #
 
 
 # GENERAL ROUTES #
 @app.route("/")
+@weak_etag
 def home():
     authorized = session.get("logged_in", False) and google.authorized
     return render_template("index.html", authorized=authorized)
@@ -79,49 +386,47 @@ def home():
 
 @one_user_type_allowed("attendee")
 @app.route("/search", methods=["GET", "POST"])
+@weak_etag
 def search():
     if request.method == "POST":
         country = request.form.get("country")
         city = request.form.get("city")
         if city:
+            if not known_city(city):
+                return "Unknown city", 400
             # Clean the city input and store it in the session
-            city = bleach.clean(city)
+            city = sanitize(city)
             session["city"] = city
+            city_views.record(session.get("country"), city)
 
             # Logic to handle fetching events based on the city
-            req = {"function": "get", "object_type": "event", "identifier": city}
-            status_code, resp_content = make_authorized_request(
-                "/get_events_in_city", req
-            )
-            if status_code != 200:
-                return "Failed to fetch events", status_code
-            events = resp_content.get("message").get("data")
+            try:
+                events, stale = fetch_city_events(city)
+            except GatewayError as e:
+                return "Failed to fetch events", e.status_code
+            event_indexes.put(city, EventSearchIndex(events, stale=stale))
+            prefetch_next_page(city, len(events), stale)
 
             # Convert timestamps to date and time
-            events.sort(key=lambda event: datetime.fromisoformat(event["date_time"]))
-            for event in events:
-                dt_object = datetime.fromisoformat(event["date_time"])
-                event["date"] = dt_object.date()
-                event["time"] = dt_object.strftime("%H:%M")
-            return render_template("events.html", events=events)
+            events = annotate_event_dates(events)
+            return render_listing("events.html", events=events, stale=stale)
         elif country:
+            if country not in known_countries:
+                return "Unknown country", 400
             # Clean the country input and store it in the session
-            country = bleach.clean(country)
+            country = sanitize(country)
             session["country"] = country
 
-            # Logic to handle fetching cities based on the country
-            req = {"function": "get", "object_type": "city", "identifier": country}
-            status_code, resp_content = make_authorized_request(
-                "/get_cities_by_country", req
-            )
-            if status_code != 200:
-                return "Failed to fetch cities", status_code
-            cities = resp_content.get("message").get("data")
+            # Build the country's city index now so suggestions are served from memory
+            try:
+                city_index.get(country)
+            except GatewayError as e:
+                return "Failed to fetch cities", e.status_code
+            prefetch_popular_cities(country)
 
-            # Render the search template with the list of cities and the selected country
+            # The page only ships the city input, matching cities come from /cities/suggest
             return render_template(
                 "search.html",
-                cities=cities,
                 countries=countries,
                 selected_country=country,
             )
@@ -129,10 +434,27 @@ def search():
     # For a GET request or if no country is selected yet, show the initial country selection form
     selected_country = session.get("country", "")
     return render_template(
-        "search.html", countries=countries, selected_country=selected_country, cities=[]
+        "search.html", countries=countries, selected_country=selected_country
     )
 
 
+@app.route("/cities/suggest")
+def suggest_cities():
+    country = request.args.get("country") or session.get("country")
+    if not country:
+        return jsonify({"error": "No country selected"}), 400
+    if country not in known_countries:
+        # Every new country builds and caches an index, only do that for real ones
+        return jsonify({"error": "Unknown country"}), 400
+    query = request.args.get("q", "").strip()
+    limit = min(request.args.get("limit", 10, type=int), 50)
+    try:
+        index = city_index.get(country)
+    except GatewayError as e:
+        return jsonify({"error": "Failed to fetch cities"}), e.status_code
+    return jsonify(index.suggest(query, limit))
+
+
 @app.route("/events", methods=["GET", "POST"])
 @login_required
 def events():
@@ -155,23 +477,15 @@ def events():
     elif user_type == "attendee":
         city = session.get("city")
         if city:
-            req = {"function": "get", "object_type": "event", "identifier": city}
-            status_code, resp_content = make_authorized_request(
-                "/get_events_in_city", req
-            )
-            if status_code != 200:
+            try:
+                events, stale = fetch_city_events(city)
+            except GatewayError:
                 return "Failed to fetch events"
-            events = resp_content.get("message").get("data")
+            event_indexes.put(city, EventSearchIndex(events, stale=stale))
             available_events = [event for event in events if event.get("status") != "Cancelled"]
-            available_events.sort(key=lambda event: datetime.fromisoformat(event["date_time"]))
-            for event in available_events:
-                timestamp = event["date_time"]
-                dt_object = datetime.fromisoformat(timestamp)
-                date = dt_object.date()
-                time = dt_object.strftime("%H:%M")
-                event["date"] = date
-                event["time"] = time
-            return render_template("events.html", events=available_events)
+            prefetch_next_page(city, len(available_events), stale)
+            available_events = annotate_event_dates(available_events)
+            return render_listing("events.html", events=available_events, stale=stale)
         return redirect(url_for("search"))
     else:
         session.clear()
@@ -183,15 +497,235 @@ def events():
     data = event_data.get("message").get("data")
     data = session.get("user_events") if user_type == "venue" else data
     data = [event for event in data if event.get("status") != "Cancelled"]
+    data = annotate_event_dates(data, sort=False)
     for event in data:
-        timestamp = event["date_time"]
-        dt_object = datetime.fromisoformat(timestamp)
-        date = dt_object.date()
-        time = dt_object.strftime("%H:%M")
-        event["date"] = date
-        event["time"] = time
         event.pop("date_time")
-    return render_template("events.html", user_type=user_type, events=data)
+    return render_listing("events.html", user_type=user_type, events=data)
+
+
+@app.route("/events/search")
+@one_user_type_allowed("attendee")
+def search_events():
+    city = request.args.get("city") or session.get("city")
+    if not city:
+        return redirect(url_for("search"))
+    if city != session.get("city") and not known_city(city):
+        return "Unknown city", 400
+    try:
+        index = event_indexes.get(city)
+    except GatewayError:
+        flash("Failed to fetch events", "error")
+        return redirect(url_for("search"))
+    results = index.search(
+        query=request.args.get("q", ""),
+        date_from=request.args.get("date_from") or None,
+        date_to=request.args.get("date_to") or None,
+        min_price=request.args.get("min_price", type=float),
+        max_price=request.args.get("max_price", type=float),
+    )
+    results = annotate_event_dates(results, sort=False)
+    return render_listing("events.html", events=results, stale=index.stale)
+
+
+NEARBY_MAX_KM = int(os.environ.get("NEARBY_MAX_KM", "200"))
+NEARBY_MAX_CITIES = int(os.environ.get("NEARBY_MAX_CITIES", "10"))
+NEARBY_MAX_EVENTS = int(os.environ.get("NEARBY_MAX_EVENTS", "1000"))
+nearby_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("NEARBY_CONCURRENCY", "4")), thread_name_prefix="nearby"
+)
+
+
+def load_event_indexes(cities):
+    """Event indexes for the cities that could be loaded, fetching the uncached ones concurrently"""
+    indexes = {city: event_indexes.peek(city) for city in cities}
+    futures = {
+        city: nearby_executor.submit(contextvars.copy_context().run, event_indexes.get, city)
+        for city, index in indexes.items()
+        if index is None
+    }
+    for city, future in futures.items():
+        try:
+            indexes[city] = future.result()
+        except GatewayError:
+            # Show what the other cities have rather than failing the whole page
+            del indexes[city]
+    return indexes
+
+
+@app.route("/events/nearby")
+@login_required
+@one_user_type_allowed("attendee")
+def nearby_events():
+    country = session.get("country")
+    city = request.args.get("city") or session.get("city")
+    if not country or not city:
+        return redirect(url_for("search"))
+    km = min(max(request.args.get("km", 25, type=float), 0), NEARBY_MAX_KM)
+    try:
+        grid = city_grids.get(country)
+    except GatewayError as e:
+        flash("Nearby search isn't available yet" if e.status_code == 404 else "Failed to fetch cities", "error")
+        return redirect(url_for("events"))
+    if city not in grid.coordinates:
+        flash(f"We don't know where {city} is yet", "error")
+        return redirect(url_for("events"))
+    nearby = grid.within(*grid.coordinates[city], km, limit=NEARBY_MAX_CITIES)
+    indexes = load_event_indexes([name for _, name in nearby])
+    # Each index hands out its events already in date order, so merging them is linear
+    events = merge_by_date(
+        [
+            [dict(event, city=name, distance_km=round(distance, 1)) for event in indexes[name].search()]
+            for distance, name in nearby
+            if name in indexes
+        ]
+    )
+    events = annotate_event_dates(list(islice(events, NEARBY_MAX_EVENTS)), sort=False)
+    return render_listing(
+        "events.html",
+        events=events,
+        stale=grid.stale or any(index.stale for index in indexes.values()),
+        nearby={"city": city, "km": km, "cities": [name for _, name in nearby if name in indexes]},
+    )
+
+
+EXPORT_PAGE_SIZE = int(os.environ.get("EXPORT_PAGE_SIZE", "500"))
+EXPORT_MAX_PAGES = int(os.environ.get("EXPORT_MAX_PAGES", "200"))
+EXPORT_FORMATS = {
+    "csv": (csv_rows, "text/csv"),
+    "ics": (ics_lines, "text/calendar"),
+}
+
+
+@app.route("/events/export.<fmt>")
+@login_required
+def export_events(fmt):
+    user_type = session.get("user_type")
+    if fmt not in EXPORT_FORMATS:
+        abort(404)
+    if user_type == "venue":
+        endpoint_path = "/get_events_for_venue"
+    elif user_type == "artist":
+        endpoint_path = "/get_events_for_artist"
+    else:
+        return redirect(url_for("events"))
+    user_id = session.get("user_id")
+
+    def fetch_page(page, page_size):
+        req = {
+            "function": "get",
+            "object_type": "event",
+            "identifier": user_id,
+            "page": page,
+            "page_size": page_size,
+        }
+        status_code, resp_content = make_authorized_request(endpoint_path, req)
+        if status_code != 200:
+            raise GatewayError(status_code, resp_content)
+        return resp_content.get("message").get("data")
+
+    # Fetch the first page up front so a gateway failure can still redirect
+    try:
+        first_page = fetch_page(0, EXPORT_PAGE_SIZE)
+    except GatewayError:
+        flash("Failed to fetch events", "error")
+        return redirect(url_for("events"))
+    render_rows, mimetype = EXPORT_FORMATS[fmt]
+    rows = render_rows(iter_pages(fetch_page, EXPORT_PAGE_SIZE, first_page=first_page, max_pages=EXPORT_MAX_PAGES))
+    return Response(
+        rows,
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=events.{fmt}"},
+    )
+
+
+# ADMIN ROUTES #
+@app.route("/admin/profiler", methods=["GET", "POST", "DELETE"])
+@admin_required
+def admin_profiler():
+    # Only this worker's profiler: with several workers, repeat until each one has answered
+    if request.method == "POST":
+        seconds = min(request.values.get("seconds", 30, type=float), PROFILER_MAX_SECONDS)
+        profiler.enable(seconds, route=request.values.get("route") or None)
+    elif request.method == "DELETE":
+        profiler.disable()
+    return jsonify(
+        {
+            "sampling": profiler.sampling,
+            "route": profiler.route,
+            "samples": sum(profiler.stacks.values()),
+            "slow_requests": len(profiler.slow_requests),
+            "slow_request_ms": profiler.slow_ms,
+            "worker_pid": os.getpid(),
+        }
+    )
+
+
+@app.route("/admin/profiler/profile.txt")
+@admin_required
+def admin_profile_download():
+    return Response(
+        profiler.collapsed(),
+        mimetype="text/plain",
+        headers={"Content-Disposition": "attachment; filename=profile.collapsed.txt"},
+    )
+
+
+@app.route("/admin/profiler/slow")
+@admin_required
+def admin_slow_requests():
+    return jsonify(list(profiler.slow_requests))
+
+
+@app.route("/admin/traces")
+@admin_required
+def admin_traces():
+    traces = tracer.query(
+        endpoint=request.args.get("endpoint") or None,
+        min_ms=request.args.get("min_ms", 0.0, type=float),
+        limit=request.args.get("limit", 50, type=int),
+    )
+    return jsonify([trace.to_dict() for trace in traces])
+
+
+@app.route("/admin/traces/<trace_id>")
+@admin_required
+def admin_trace(trace_id):
+    trace = tracer.find(trace_id)
+    if trace is None:
+        return jsonify({"error": "Trace not found"}), 404
+    return jsonify(trace.to_dict())
+
+
+# METRICS ROUTES #
+@app.route("/metrics")
+@admin_required
+def metrics():
+    return jsonify(
+        {
+            "waiting_room": waiting_room.stats(),
+            "memory": memory_accounting.stats(),
+            "prefetch": prefetcher.stats(),
+            "purchases": purchase_queue.stats(),
+        }
+    )
+
+
+# HEALTH ROUTES #
+@app.route("/healthz")
+def healthz():
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    # Only report ready once this worker holds a valid gateway token, so the
+    # load balancer never routes the first requests to a cold worker
+    if not token_is_warm():
+        try:
+            get_token()
+        except Exception as e:
+            return jsonify({"status": "unavailable", "reason": str(e)}), 503
+    return jsonify({"status": "ready"})
 
 
 # ACCOUNT MANAGEMENT #
@@ -205,7 +739,7 @@ def login():
 
 @app.route("/after_login")
 def after_login():
-    account_info = google.get("/oauth2/v2/userinfo")
+    account_info = google_userinfo()
     if account_info.ok:
         account_info_json = account_info.json()
         session["logged_in"] = True
@@ -254,7 +788,7 @@ def profile(user_id, account_type="venue"):
     user_info = session.get("user_info", {})
     user_info["user_type"] = session.get("user_type")
     if not session.get("user_info"):
-        user_info = google.get("/oauth2/v2/userinfo").json()
+        user_info = google_userinfo().json()
         session["user_info"] = user_info
 
     if session["user_id"] != user_id:
@@ -285,18 +819,21 @@ def profile(user_id, account_type="venue"):
             "identifier": user_id,
             "attributes": attributes,
         }
-        status_code, resp_content = make_authorized_request("/get_account_info", req)
-        if status_code != 200:
-            flash("Failed to fetch user info")
-            return redirect(url_for("events"))
-        else:
-            profile_picture = resp_content.get("profile_picture", "")
-            return render_template(
-                "other_profile.html",
-                user_info=resp_content['data'],
-                profile_picture=profile_picture,
-                account_type=account_type,
-            )
+        cache_key = f"account:{account_type}:{user_id}"
+        resp_content = shared_cache.get(cache_key)
+        if resp_content is None:
+            status_code, resp_content = make_authorized_request("/get_account_info", req)
+            if status_code != 200:
+                flash("Failed to fetch user info")
+                return redirect(url_for("events"))
+            shared_cache.set(cache_key, resp_content, ACCOUNT_INFO_TTL)
+        profile_picture = resp_content.get("profile_picture", "")
+        return render_template(
+            "other_profile.html",
+            user_info=resp_content['data'],
+            profile_picture=profile_picture,
+            account_type=account_type,
+        )
 
     profile_picture = session.get("profile_picture", "")
     account_info = session["user_info"]
@@ -319,9 +856,9 @@ def logout():
 @login_required
 def set_profile(function="create"):
     if request.method == "POST":
-        user_type = bleach.clean(request.form.get("user_type"))
+        user_type = sanitize(request.form.get("user_type"))
         session["user_type"] = user_type
-        account_info_json = google.get("/oauth2/v2/userinfo").json()
+        account_info_json = google_userinfo().json()
         identifier = account_info_json.get("id")
         create_request = {
             "function": "create",
@@ -329,32 +866,32 @@ def set_profile(function="create"):
             "identifier": identifier,
             "attributes": {
                 "user_id": identifier,
-                "email": bleach.clean(request.form.get("email")),
-                "street_address": bleach.clean(request.form.get("street_address")),
-                "city": bleach.clean(request.form.get("city")),
-                "postcode": bleach.clean(request.form.get("postcode")),
-                "bio": bleach.clean(request.form.get("bio")),
+                "email": sanitize(request.form.get("email")),
+                "street_address": sanitize(request.form.get("street_address")),
+                "city": sanitize(request.form.get("city")),
+                "postcode": sanitize(request.form.get("postcode")),
+                "bio": sanitize(request.form.get("bio")),
             },
         }
         if user_type == "venue":
-            create_request["attributes"]["venue_name"] = bleach.clean(
+            create_request["attributes"]["venue_name"] = sanitize(
                 request.form.get("venue_name")
             )
         elif user_type == "artist":
-            create_request["attributes"]["artist_name"] = bleach.clean(
+            create_request["attributes"]["artist_name"] = sanitize(
                 request.form.get("artist_name")
             )
-            create_request["attributes"]["genres"] = bleach.clean(
+            create_request["attributes"]["genres"] = sanitize(
                 request.form.get("genres")
             )
-            create_request["attributes"]["spotify_artist_id"] = bleach.clean(
+            create_request["attributes"]["spotify_artist_id"] = sanitize(
                 request.form.get("spotify_artist_id")
             )
         elif user_type == "attendee":
-            create_request["attributes"]["first_name"] = bleach.clean(
+            create_request["attributes"]["first_name"] = sanitize(
                 request.form.get("user_name")
             )
-            create_request["attributes"]["last_name"] = bleach.clean(
+            create_request["attributes"]["last_name"] = sanitize(
                 request.form.get("last_name")
             )
         status_code, resp_content = make_authorized_request(
@@ -390,6 +927,7 @@ def delete_account():
             "/delete_account", delete_request
         )
         if status_code == 200:
+            shared_cache.delete(f"account:{session.get('user_type')}:{session.get('user_id')}")
             session.clear()
             session["status"] = "Inactive"
             flash("Account deleted", "success")
@@ -406,7 +944,7 @@ def update_account():
     if request.method == "POST":
         update_attrs = request.form.to_dict()
         sanitised_attrs = {
-            key: bleach.clean(value) for key, value in update_attrs.items()
+            key: sanitize(value) for key, value in update_attrs.items()
         }
         headers = {
             "function": "update",
@@ -415,52 +953,125 @@ def update_account():
             "attributes": sanitised_attrs,
         }
         make_authorized_request("/update_account", request=headers)
+        shared_cache.delete(f"account:{session.get('user_type')}:{session.get('user_id')}")
         session.update(sanitised_attrs)
         return redirect(url_for("profile", user_id=session.get("user_id")))
     return render_template("update_account.html", user_type=session["user_type"])
 
 
 # ATTENDEE SPECIFIC ROUTES #
+def listed_event(event_id, city):
+    """Whether event_id is on sale in city, which must be the buyer's city or one near it"""
+    grid = city_grids.peek(session.get("country"))
+    if not city or (city != session.get("city") and (grid is None or city not in grid.coordinates)):
+        return False
+    try:
+        return event_id in event_indexes.get(city)
+    except GatewayError:
+        return False
+
+
+def picked_event(event_id):
+    # Waiting rooms are only entered through buy_event, for the event picked there
+    return session.get("event_info", {}).get("event_event_id") == event_id
+
+
+@app.route("/buy/<event_id>", methods=["GET", "POST"])
+@login_required
 @one_user_type_allowed("attendee")
-@app.route("/buy/<event_id>", methods=["POST"])
 def buy_event(event_id):
-    event_data = {}
-    update_attrs = request.form.to_dict()
-    sanitised_attrs = {key: bleach.clean(value) for key, value in update_attrs.items()}
-    event_data.update(sanitised_attrs)
-    session["event_info"] = event_data
-    return render_template("buy.html", event=event_data, event_id=event_id)
+    if request.method == "POST":
+        if not listed_event(event_id, request.form.get("event_city") or session.get("city")):
+            flash("This event isn't on sale", "error")
+            return redirect(url_for("events"))
+        event_data = {}
+        update_attrs = request.form.to_dict()
+        sanitised_attrs = {key: sanitize(value) for key, value in update_attrs.items()}
+        event_data.update(sanitised_attrs)
+        session["event_info"] = event_data
+    elif not picked_event(event_id):
+        # Coming back from the waiting room is only valid for the event picked before
+        return redirect(url_for("events"))
+    status, _ = waiting_room.enter(event_id, session["user_id"])
+    if status == REJECTED or checkout_overloaded():
+        return overloaded_response()
+    if status == QUEUED:
+        return redirect(url_for("waiting_room_page", event_id=event_id))
+    return render_template(
+        "buy.html", event=session["event_info"], event_id=event_id, idempotency_key=secrets.token_urlsafe(16)
+    )
+
+
+@app.route("/waiting_room/<event_id>")
+@login_required
+@one_user_type_allowed("attendee")
+def waiting_room_page(event_id):
+    if not picked_event(event_id):
+        return redirect(url_for("events"))
+    status, position = waiting_room.enter(event_id, session["user_id"])
+    if status == REJECTED:
+        return overloaded_response()
+    if status == ADMITTED:
+        return redirect(url_for("buy_event", event_id=event_id))
+    return render_template("waiting_room.html", event_id=event_id, position=position)
+
+
+@app.route("/waiting_room/<event_id>/status")
+@login_required
+@one_user_type_allowed("attendee")
+def waiting_room_status(event_id):
+    if not picked_event(event_id):
+        return jsonify({"error": "Unknown event"}), 404
+    status, position = waiting_room.enter(event_id, session["user_id"])
+    if status == REJECTED:
+        return overloaded_response()
+    return jsonify({"status": status, "position": position})
 
 
 @app.route("/checkout/<event_id>", methods=["GET", "POST"])
+@login_required
+@one_user_type_allowed("attendee")
 def checkout(event_id):
+    if checkout_overloaded():
+        return overloaded_response()
+    if not waiting_room.is_admitted(event_id, session["user_id"]):
+        return redirect(url_for("waiting_room_page", event_id=event_id))
     total_tickets = int(session["event_info"]["event_total_tickets"])
     sold_tickets = int(session["event_info"]["event_sold_tickets"])
     tickets_left = total_tickets - sold_tickets
     if int(request.form.get("quantity")) > tickets_left:
         flash("Not enough tickets left", "error")
         session.pop("event_info")
+        waiting_room.release(event_id, session["user_id"])
         return redirect(url_for("events", id=event_id))
+    key = request_idempotency_key()
     reserve_request = {
         "identifier": event_id,
         "n_tickets": request.form.get("quantity"),
+        "idempotency_key": key,
     }
-    status_code, resp_content = make_authorized_request(
-        "/reserve_tickets", reserve_request
+    # A resubmitted buy form gets the tickets the first submit reserved
+    status_code, resp_content, replayed = idempotent_request(
+        f"reserve:{session['user_id']}", key, "/reserve_tickets", reserve_request
     )
     if status_code == 400:
         flash("Tickets are sold out", "error")
+        waiting_room.release(event_id, session["user_id"])
         return redirect(url_for("events", id=event_id))
     elif status_code != 200:
         flash("Failed to reserve tickets", "error")
         return redirect(url_for("events", id=event_id))
     ticket_ids = resp_content["data"]
     session["ticket_ids"] = ticket_ids
+    dashboard = venue_dashboards.peek(session["event_info"].get("event_venue_id"))
+    if dashboard is not None and not replayed:
+        dashboard.record_reservation(event_id, len(ticket_ids))
     return render_template("checkout.html", event_id=event_id)
 
 
-@one_user_type_allowed("attendee")
 @app.route("/purchase_ticket/<event_id>", methods=["POST"])
+@login_required
+@one_user_type_allowed("attendee")
 def purchase_ticket(event_id):
     if (
         session.get("event_info") is None
@@ -469,28 +1080,151 @@ def purchase_ticket(event_id):
     ):
         flash("You are not authorized to purchase tickets for this event", "error")
         return redirect(url_for("events"))
-    ticket_request = {
-        "function": "create",
-        "object_type": "ticket",
-        "identifier": session["user_id"],
-        "ticket_ids": session.get("ticket_ids"),
+    ticket_ids = session["ticket_ids"]
+    # Same user and tickets, same key: double submits and retries can't buy twice
+    key = derive_key(session["user_id"], *sorted(map(str, ticket_ids)))
+    purchase = {
+        "idempotency_key": key,
+        "user_id": session["user_id"],
+        "event_id": event_id,
+        "venue_id": session["event_info"].get("event_venue_id"),
+        "request": {
+            "function": "create",
+            "object_type": "ticket",
+            "identifier": session["user_id"],
+            "ticket_ids": ticket_ids,
+            "idempotency_key": key,
+        },
     }
-    status_code, resp_content = make_authorized_request(
-        "/purchase_tickets", ticket_request
+    if PURCHASE_CONFIRMATION == "async":
+        purchase_queue.enqueue(key, purchase)
+        session.pop("ticket_ids")
+        waiting_room.release(event_id, session["user_id"])
+        return redirect(url_for("purchase_status_page", key=key))
+    status_code, resp_content, replayed = idempotent_request(
+        "purchase", key, "/purchase_tickets", purchase["request"]
     )
     if status_code == 200:
         flash(
-            "Ticket(s) purchased! You should receive the tickets in your email.",
+            "Ticket(s) purchased! You can find them under My tickets and in your email.",
             "success",
         )
         session.pop("ticket_ids")
+        if not replayed:
+            record_purchase(purchase)
+        waiting_room.release(event_id, session["user_id"])
         return redirect(url_for("events"))
-    else:
-        flash("Failed to purchase ticket", "error")
-        return redirect(url_for("events"))
+    flash("Failed to purchase ticket", "error")
     return redirect(url_for("events"))
 
 
+def own_purchase(key):
+    purchase = purchase_queue.get(key)
+    if purchase is None or purchase["payload"]["user_id"] != session.get("user_id"):
+        abort(404)
+    return purchase
+
+
+@app.route("/purchases/<key>")
+@login_required
+@one_user_type_allowed("attendee")
+def purchase_status_page(key):
+    purchase = own_purchase(key)
+    return render_template(
+        "purchase_ticket.html",
+        key=key,
+        status=purchase["status"],
+        n_tickets=len(purchase["payload"]["request"]["ticket_ids"]),
+    )
+
+
+@app.route("/purchases/<key>/status")
+@login_required
+@one_user_type_allowed("attendee")
+def purchase_status(key):
+    return jsonify({"status": own_purchase(key)["status"]})
+
+
+TICKETS_TTL = int(os.environ.get("CACHE_TICKETS_TTL", "60"))
+ticket_renderer = TicketRenderer(
+    os.environ.get("TICKET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "jumpstart-tickets")),
+    max_workers=int(os.environ.get("TICKET_RENDER_WORKERS", "2")),
+)
+# QR codes carry a signed ticket reference so they can be checked at the door without a lookup
+ticket_signer = URLSafeSerializer(app.secret_key, salt="ticket")
+
+
+def fetch_user_tickets(user_id):
+    # /get_tickets_for_attendee is assumed, the baseline gateway client has no ticket listing call
+    def fetch():
+        req = {"function": "get", "object_type": "ticket", "identifier": user_id}
+        status_code, resp_content = make_authorized_request("/get_tickets_for_attendee", req)
+        if status_code != 200:
+            raise GatewayError(status_code, resp_content)
+        return resp_content.get("message").get("data")
+
+    tickets = shared_cache.get_or_compute(f"tickets:{user_id}", fetch, TICKETS_TTL)
+    return sorted(tickets, key=lambda ticket: (ticket.get("date_time") or "", str(ticket.get("ticket_id"))))
+
+
+def ticket_payload(ticket):
+    return ticket_signer.dumps({"ticket_id": ticket["ticket_id"], "event_id": ticket.get("event_id")})
+
+
+def cached_ticket_response(data, key, mimetype, **kwargs):
+    response = Response(data, mimetype=mimetype, **kwargs)
+    response.set_etag(key)
+    response.headers["Cache-Control"] = "private, max-age=86400"
+    return response.make_conditional(request)
+
+
+@app.route("/tickets")
+@login_required
+@one_user_type_allowed("attendee")
+def my_tickets():
+    try:
+        tickets = fetch_user_tickets(session.get("user_id"))
+    except GatewayError as e:
+        flash("My tickets isn't available yet" if e.status_code == 404 else "Failed to fetch tickets", "error")
+        return redirect(url_for("events"))
+    return render_template("my_tickets.html", tickets=tickets)
+
+
+@app.route("/tickets/<ticket_id>/qr.svg")
+@login_required
+@one_user_type_allowed("attendee")
+def ticket_qr(ticket_id):
+    try:
+        tickets = fetch_user_tickets(session.get("user_id"))
+    except GatewayError as e:
+        return "Failed to fetch tickets", e.status_code
+    ticket = next((ticket for ticket in tickets if str(ticket.get("ticket_id")) == ticket_id), None)
+    if ticket is None:
+        abort(404)
+    payload = ticket_payload(ticket)
+    return cached_ticket_response(ticket_renderer.qr_svg(ticket, payload), ticket_key(ticket, payload), "image/svg+xml")
+
+
+@app.route("/tickets/tickets.pdf")
+@login_required
+@one_user_type_allowed("attendee")
+def tickets_pdf():
+    try:
+        tickets = fetch_user_tickets(session.get("user_id"))
+    except GatewayError:
+        flash("Failed to fetch tickets", "error")
+        return redirect(url_for("my_tickets"))
+    if not tickets:
+        return redirect(url_for("my_tickets"))
+    pairs = [(ticket, ticket_payload(ticket)) for ticket in tickets]
+    return cached_ticket_response(
+        ticket_renderer.pdf(pairs),
+        document_key(pairs),
+        "application/pdf",
+        headers={"Content-Disposition": "attachment; filename=tickets.pdf"},
+    )
+
+
 # VENUE SPECIFIC ROUTES #
 @one_user_type_allowed("venue")
 @app.route("/manage/<event_id>", methods=["GET", "POST"])
@@ -511,6 +1245,17 @@ def manage_event(event_id):
     return render_template("manage.html", event=this_event, date=date)
 
 
+@app.route("/dashboard")
+@one_user_type_allowed("venue")
+def venue_dashboard():
+    try:
+        dashboard = venue_dashboards.get(session.get("user_id"))
+    except GatewayError:
+        flash("Failed to fetch events", "error")
+        return redirect(url_for("events"))
+    return render_template("dashboard.html", summary=dashboard.summary())
+
+
 @one_user_type_allowed("venue")
 @app.route("/delete/<event_id>", methods=["POST"])
 def delete_event(event_id):
@@ -537,6 +1282,12 @@ def delete_event(event_id):
         return redirect(url_for("events"))
     else:
         session["user_events"].remove(this_event)
+        for city, index in event_indexes.items():
+            if index.remove(event_id):
+                shared_cache.delete(f"events:{city}")
+        dashboard = venue_dashboards.peek(session.get("user_id"))
+        if dashboard is not None:
+            dashboard.remove_event(event_id)
         flash("Event deleted", "success")
         return redirect(url_for("events"))
 
@@ -545,13 +1296,13 @@ def delete_event(event_id):
 @app.route("/create_event", methods=["GET", "POST"])
 def create_event():
     if request.method == "POST":
-        event_date = bleach.clean(request.form.get("event_date"))
-        event_time = bleach.clean(request.form.get("event_time"))
-        event_artist = [bleach.clean(request.form.get("artist"))]
+        event_date = sanitize(request.form.get("event_date"))
+        event_time = sanitize(request.form.get("event_time"))
+        event_artist = [sanitize(request.form.get("artist"))]
         date_and_time = datetime.strptime(f"{event_date} {event_time}", "%Y-%m-%d %H:%M").isoformat()
-        event_name = bleach.clean(request.form.get("event_name"))
-        event_price = bleach.clean(request.form.get("event_price"))
-        event_capacity = bleach.clean(request.form.get("event_capacity"))
+        event_name = sanitize(request.form.get("event_name"))
+        event_price = sanitize(request.form.get("event_price"))
+        event_capacity = sanitize(request.form.get("event_capacity"))
         create_request = {
             "function": "create",
             "object_type": "event",
@@ -578,6 +1329,13 @@ def create_event():
                 "/create_tickets", ticket_request
             )
             if status_code == 200:
+                index = event_indexes.peek(session.get("city"))
+                if index is not None:
+                    index.add(dict(create_request["attributes"], event_id=event_id, price=event_price))
+                shared_cache.delete(f"events:{session.get('city')}")
+                dashboard = venue_dashboards.peek(session.get("user_id"))
+                if dashboard is not None:
+                    dashboard.add_event(dict(create_request["attributes"], event_id=event_id, price=event_price))
                 flash("Event created", "success")
                 return redirect(url_for("events"))
             else:
@@ -604,7 +1362,7 @@ def update_event(event_id):
     if request.method == "POST":
         update_attrs = request.form.to_dict()
         sanitised_attrs = {
-            key: bleach.clean(value) for key, value in update_attrs.items()
+            key: sanitize(value) for key, value in update_attrs.items()
         }
         status_code, resp_content = make_authorized_request(
             "/update_event",
@@ -613,6 +1371,16 @@ def update_event(event_id):
         if status_code != 200:
             flash("Failed to update event", "error")
             return redirect(url_for("manage_event", event_id=this_event["event_id"]))
+        indexed_attrs = {}
+        if sanitised_attrs.get("event_name"):
+            indexed_attrs["event_name"] = sanitised_attrs["event_name"]
+        if sanitised_attrs.get("event_date") and sanitised_attrs.get("event_time"):
+            indexed_attrs["date_time"] = datetime.strptime(
+                f"{sanitised_attrs['event_date']} {sanitised_attrs['event_time']}", "%Y-%m-%d %H:%M"
+            ).isoformat()
+        for city, index in event_indexes.items():
+            if index.update(this_event["event_id"], indexed_attrs):
+                shared_cache.delete(f"events:{city}")
         flash("Event updated", "success")
         return redirect(url_for("manage_event", event_id=this_event["event_id"]))
     else:
@@ -625,5 +1393,79 @@ def update_event(event_id):
         )
 
 
+BULK_MAX_EVENTS = int(os.environ.get("BULK_MAX_EVENTS", "200"))
+# Shared by every bulk request in the worker, so together they stay within BULK_CONCURRENCY gateway calls
+bulk_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BULK_CONCURRENCY", "4")), thread_name_prefix="bulk"
+)
+
+
+def apply_event_changes(changed):
+    """Applies {event_id: event after the change} to the session, the event indexes,
+    the shared cache and the dashboard in one pass"""
+    session["user_events"] = [
+        changed.get(event.get("event_id"), event)
+        for event in session.get("user_events", [])
+        if changed.get(event.get("event_id"), event).get("status") != "Cancelled"
+    ]
+    for city, index in event_indexes.items():
+        touched = False
+        for event_id, event in changed.items():
+            if event.get("status") == "Cancelled":
+                touched = index.remove(event_id) or touched
+            else:
+                attrs = {key: event[key] for key in ("date_time", "price") if key in event}
+                touched = index.update(event_id, attrs) or touched
+        if touched:
+            shared_cache.delete(f"events:{city}")
+    dashboard = venue_dashboards.peek(session.get("user_id"))
+    if dashboard is not None:
+        for event_id, event in changed.items():
+            if event.get("status") == "Cancelled":
+                dashboard.remove_event(event_id)
+            elif not dashboard.update_event(event_id, event.get("date_time"), event.get("price")):
+                # Session events carry no date_time until rescheduled, add_event skips those
+                dashboard.add_event(event)
+
+
+@app.route("/events/bulk", methods=["POST"])
+@one_user_type_allowed("venue")
+def bulk_update_events():
+    if request.is_json:
+        body = request.get_json(silent=True) or {}
+        event_ids = body.get("event_ids") or []
+    else:
+        body = request.form
+        event_ids = request.form.getlist("event_ids")
+    operation = body.get("operation")
+    if not isinstance(event_ids, list) or not all(isinstance(event_id, str) for event_id in event_ids):
+        return jsonify({"error": "event_ids must be a list of event ids"}), 400
+    event_ids = list(dict.fromkeys(event_ids))
+    if not event_ids or len(event_ids) > BULK_MAX_EVENTS:
+        return jsonify({"error": f"Send between 1 and {BULK_MAX_EVENTS} event ids"}), 400
+    try:
+        params = parse_params(operation, body)
+    except BulkOperationError as e:
+        return jsonify({"error": str(e)}), 400
+
+    user_events = {event.get("event_id"): event for event in session.get("user_events", [])}
+    owned = [user_events[event_id] for event_id in event_ids if event_id in user_events]
+    outcomes = {
+        outcome["event_id"]: outcome
+        for outcome in apply_bulk(owned, operation, params, make_authorized_request, bulk_executor)
+    }
+    apply_event_changes({event_id: outcome.pop("event") for event_id, outcome in outcomes.items() if outcome["ok"]})
+    results = [
+        outcomes.get(event_id)
+        or {"event_id": event_id, "ok": False, "status": 403, "error": "Not one of your events"}
+        for event_id in event_ids
+    ]
+    succeeded = sum(result["ok"] for result in results)
+    return jsonify(
+        {"operation": operation, "succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
+    )
+
+
 if __name__ == "__main__":
-    app.run(debug=True)
+    # Development server only, production runs through gunicorn (see gunicorn.conf.py)
+    app.run(debug=os.environ.get("FLASK_DEBUG", "1") == "1")
@@ -1,5 +1,20 @@
-from .app import app
-import pytest
+import os
+import tempfile
+
+# Keep the tests off the cache and state files of an app running on the same host
+os.environ.setdefault("CACHE_BACKEND", "memory")
+_state_dir = tempfile.mkdtemp(prefix="jumpstart-tests-")
+for _name, _path in [
+    ("WAITING_ROOM_PATH", "waiting-room.sqlite3"),
+    ("PURCHASE_QUEUE_PATH", "purchases.sqlite3"),
+    ("CATALOG_SNAPSHOT_DIR", "catalog"),
+    ("TICKET_CACHE_DIR", "tickets"),
+    ("TEMPLATE_CACHE_DIR", "jinja-cache"),
+]:
+    os.environ.setdefault(_name, os.path.join(_state_dir, _path))
+
+from .app import app  # noqa: E402
+import pytest  # noqa: E402
 
 # Replace these with more secure user info
 sample_venue_data = {
@@ -15,6 +30,13 @@ sample_customer_data = {
 }
 
 
+@pytest.fixture(autouse=True)
+def empty_shared_cache():
+    from .utils.cache import shared_cache
+
+    shared_cache.clear()
+
+
 @pytest.fixture
 def client():
     app.config["TESTING"] = True
@@ -26,3 +48,894 @@ def test_home_page_exists(client):
     # Navigate to the home page and check it loads properly
     response = client.get("/")
     assert b"Home" in response.data, "Home page didn't load"
+
+
+def test_healthz(client):
+    response = client.get("/healthz")
+    assert response.status_code == 200
+
+
+def test_readyz_warms_token(client, monkeypatch):
+    from . import app as app_module
+
+    calls = []
+    monkeypatch.setattr(app_module, "token_is_warm", lambda: False)
+    monkeypatch.setattr(app_module, "get_token", lambda: calls.append(1) or "token")
+    response = client.get("/readyz")
+    assert response.status_code == 200
+    assert calls, "Token wasn't warmed"
+
+
+def test_readyz_unavailable_without_token(client, monkeypatch):
+    from . import app as app_module
+
+    def failing_get_token():
+        raise RuntimeError("no credentials")
+
+    monkeypatch.setattr(app_module, "token_is_warm", lambda: False)
+    monkeypatch.setattr(app_module, "get_token", failing_get_token)
+    response = client.get("/readyz")
+    assert response.status_code == 503
+
+
+def test_home_page_weak_etag(client):
+    response = client.get("/")
+    etag = response.headers.get("ETag")
+    assert etag and etag.startswith("W/"), "Home page has no weak ETag"
+    response = client.get("/", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+
+def test_large_html_is_gzipped(client, monkeypatch):
+    import gzip
+
+    monkeypatch.setitem(app.config, "COMPRESS_MIN_SIZE", 100)
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers.get("Content-Encoding") == "gzip"
+    assert b"Home" in gzip.decompress(response.data)
+
+
+def test_static_url_is_fingerprinted(client):
+    import re
+
+    response = client.get("/")
+    match = re.search(rb'/static/styles/style.css\?v=\w+', response.data)
+    assert match, "Stylesheet URL isn't fingerprinted"
+    response = client.get(match.group(0).decode())
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+
+
+def sample_events(n):
+    return [
+        {
+            "event_id": str(i),
+            "event_name": f"Event {i}",
+            "venue_id": "venue",
+            "artist_ids": ["artist"],
+            "date_time": f"2024-05-{i % 28 + 1:02d}T20:00:00",
+            "total_tickets": 100,
+            "sold_tickets": 10,
+            "status": "Active",
+        }
+        for i in range(n)
+    ]
+
+
+def choose_country(client, *cities, country="Sweden"):
+    """Picks country in the session and makes cities its known cities"""
+    from . import app as app_module
+    from .services.city_index import PrefixIndex
+
+    app_module.city_index.put(country, PrefixIndex(cities))
+    with client.session_transaction() as sess:
+        sess["country"] = country
+
+
+def test_city_listing_is_streamed(client, monkeypatch):
+    from . import app as app_module
+
+    events = sample_events(50)
+    monkeypatch.setattr(
+        app_module,
+        "make_authorized_request",
+        lambda endpoint, req: (200, {"message": {"data": events}}),
+    )
+    choose_country(client, "London", country="United Kingdom")
+    response = client.post("/search", data={"city": "London"})
+    assert response.is_streamed
+    assert b"<!DOCTYPE html>" in response.data
+    assert b"Event 0" in response.data
+
+
+def test_prefix_index_suggest():
+    from .services.city_index import PrefixIndex
+
+    index = PrefixIndex(["London", "Leeds", "Liverpool", "Manchester", "leicester"])
+    assert index.suggest("le") == ["Leeds", "leicester"]
+    assert index.suggest("L", limit=2) == ["Leeds", "leicester"]
+    assert index.suggest("x") == []
+
+
+def test_cities_suggest(client, monkeypatch):
+    from . import app as app_module
+
+    requests_made = []
+
+    def fake_request(endpoint, req):
+        requests_made.append(endpoint)
+        return 200, {"message": {"data": ["Lyon", "Lille", "Paris"]}}
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    response = client.get("/cities/suggest?country=France&q=l")
+    assert response.get_json() == ["Lille", "Lyon"]
+    client.get("/cities/suggest?country=France&q=p")
+    assert requests_made == ["/get_cities_by_country"], "City index wasn't reused"
+    assert client.get("/cities/suggest?country=Atlantis&q=p").status_code == 400
+    assert requests_made == ["/get_cities_by_country"], "Unknown countries mustn't reach the gateway"
+
+
+def test_event_search_index():
+    from .services.event_index import EventSearchIndex
+
+    events = sample_events(30)
+    events[3].update(event_name="Jazz Night", price="12.50")
+    events[7].update(event_name="Jazz Brunch", price="30")
+    index = EventSearchIndex(events)
+    assert [e["event_id"] for e in index.search("jaz")] == ["3", "7"]
+    assert [e["event_id"] for e in index.search("jazz", max_price=20)] == ["3"]
+    assert [e["event_id"] for e in index.search(date_from="2024-05-02", date_to="2024-05-02")] == ["1", "29"]
+
+    index.update("7", {"event_name": "Blues Brunch"})
+    assert [e["event_id"] for e in index.search("jazz")] == ["3"]
+    index.remove("3")
+    assert index.search("jazz") == []
+    index.add(dict(events[0], event_id="new", event_name="Jazz Again"))
+    assert [e["event_id"] for e in index.search("jazz")] == ["new"]
+
+
+def test_search_events_route_uses_cached_index(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+
+    requests_made = []
+
+    def fake_request(endpoint, req):
+        requests_made.append(endpoint)
+        return 200, {"message": {"data": sample_events(40)}}
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    with client.session_transaction() as sess:
+        sess["user_type"] = "attendee"
+        sess["city"] = "Bristol"
+    response = client.get("/events/search?q=event&date_from=2024-05-01&date_to=2024-05-01")
+    assert b"Event 0" in response.data and b"Event 28" in response.data
+    assert b"Event 1<" not in response.data
+    client.get("/events/search?q=event")
+    assert requests_made == ["/get_events_in_city"], "Event index wasn't reused"
+
+    # Made-up cities never reach the gateway or the index cache
+    choose_country(client, "Bath")
+    assert client.get("/events/search?city=Atlantis").status_code == 400
+    assert client.post("/search", data={"city": "Atlantis"}).status_code == 400
+    assert requests_made == ["/get_events_in_city"]
+    assert app_module.event_indexes.peek("Atlantis") is None
+
+
+def test_refreshing_cache_evicts_least_recently_used():
+    from .utils.refreshing_cache import RefreshingCache
+
+    cache = RefreshingCache(lambda key: key.upper(), max_entries=2)
+    cache.get("a")
+    cache.get("b")
+    cache.get("a")
+    cache.get("c")
+    assert [key for key, _ in cache.items()] == ["a", "c"]
+
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    from .utils import circuit_breaker
+
+    now = [0.0]
+    monkeypatch.setattr(circuit_breaker.time, "monotonic", lambda: now[0])
+    breaker = circuit_breaker.CircuitBreaker(error_rate=0.5, min_calls=4, window=4, reset_timeout=10)
+    for ok in (True, False, True, False):
+        assert breaker.allow()
+        breaker.record(ok)
+    assert not breaker.allow(), "Circuit didn't open"
+
+    now[0] = 11.0
+    assert breaker.allow(), "Circuit didn't let a probe through"
+    assert not breaker.allow(), "Circuit let two probes through"
+    breaker.record(True)
+    assert breaker.allow(), "Circuit didn't close after a good probe"
+
+
+def test_city_listing_served_from_snapshot_when_gateway_down(client, monkeypatch):
+    from . import app as app_module
+
+    responses = [(200, {"message": {"data": sample_events(3)}}), (503, "Service Unavailable")]
+    monkeypatch.setattr(app_module, "make_authorized_request", lambda endpoint, req: responses.pop(0))
+    monkeypatch.setattr(app_module.catalog_snapshot, "min_interval", 0)
+    choose_country(client, "Snapshot City")
+    response = client.post("/search", data={"city": "Snapshot City"})
+    assert b"may be out of date" not in response.data
+    app_module.shared_cache.delete("events:Snapshot City")
+    response = client.post("/search", data={"city": "Snapshot City"})
+    assert response.status_code == 200
+    assert b"Event 2" in response.data
+    assert b"may be out of date" in response.data
+
+
+def test_waiting_room_queues_over_capacity(tmp_path):
+    from .services.waiting_room import WaitingRoom, ADMITTED, QUEUED, REJECTED
+
+    path = str(tmp_path / "waiting_room.sqlite3")
+    room = WaitingRoom(path, capacity=2, max_queued=2)
+    assert room.enter("e1", "a") == (ADMITTED, 0)
+    assert room.enter("e1", "b") == (ADMITTED, 0)
+    assert room.enter("e1", "c") == (QUEUED, 1)
+    assert room.enter("e1", "d") == (QUEUED, 2)
+    assert room.enter("e1", "e") == (REJECTED, None)
+    room.release("e1", "a")
+    # Another worker sharing the file sees the same admissions and queue
+    other_worker = WaitingRoom(path, capacity=2, max_queued=2)
+    assert other_worker.is_admitted("e1", "c")
+    assert other_worker.enter("e1", "d") == (QUEUED, 1)
+    assert room.stats()["events"]["e1"] == {"admitted": 2, "queued": 1}
+    room.release("e1", "b")
+    room.release("e1", "c")
+    room.release("e1", "d")
+    assert room.stats()["events"] == {}, "Empty rooms must not linger"
+
+
+def test_buy_event_sends_buyers_over_capacity_to_waiting_room(client, monkeypatch, tmp_path):
+    from types import SimpleNamespace
+    from . import app as app_module
+    from .services.event_index import EventSearchIndex
+    from .services.waiting_room import WaitingRoom
+
+    monkeypatch.setattr(app_module, "waiting_room", WaitingRoom(str(tmp_path / "waiting_room.sqlite3"), capacity=1))
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    app_module.event_indexes.put("Queue City", EventSearchIndex([dict(sample_events(1)[0], event_id="42")]))
+    form = {"event_event_id": "42", "event_event_name": "Gig"}
+
+    def log_in(buyer, user_id):
+        with buyer.session_transaction() as sess:
+            sess.update(user_type="attendee", user_id=user_id, city="Queue City")
+
+    with app.test_client() as first_buyer:
+        log_in(first_buyer, "first")
+        assert first_buyer.post("/buy/42", data=form).status_code == 200
+    log_in(client, "second")
+    assert client.post("/buy/404", data=dict(form, event_event_id="404")).status_code == 302
+    response = client.post("/buy/42", data=form)
+    assert response.status_code == 302
+    assert "/waiting_room/42" in response.headers["Location"]
+    assert client.get("/waiting_room/42/status").get_json() == {"status": "queued", "position": 1}
+    assert client.get("/waiting_room/made-up/status").status_code == 404
+    assert app_module.waiting_room.stats()["events"] == {"42": {"admitted": 1, "queued": 1}}
+
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=False))
+    with app.test_client() as anonymous:
+        assert anonymous.get("/waiting_room/42/status").status_code == 302
+
+
+def test_metrics_requires_admin_token(client, monkeypatch):
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/metrics").status_code == 403
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    response = client.get("/metrics", headers={"Authorization": "Bearer secret"})
+    assert "waiting_room" in response.get_json()
+
+
+def test_sqlite_cache_ttl_and_eviction(tmp_path, monkeypatch):
+    from .utils import cache
+
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "time", lambda: now[0])
+    backend = cache.SQLiteCache(str(tmp_path / "cache.sqlite3"), max_entries=2)
+    assert (tmp_path / "cache.sqlite3").stat().st_mode & 0o777 == 0o600
+    backend.set("a", {"x": 1}, ttl=10)
+    backend.set("b", [1, 2], ttl=20)
+    backend.set("c", "three", ttl=30)
+    assert backend.get("a") == {"x": 1}
+    backend.evict()
+    assert backend.get("a") is None, "Entry closest to expiry wasn't evicted"
+    now[0] += 25
+    assert backend.get("b") is None
+    assert backend.get("c") == "three"
+
+
+def test_get_or_compute_is_shared_between_processes(tmp_path):
+    from .utils.cache import SQLiteCache
+
+    path = str(tmp_path / "cache.sqlite3")
+    calls = []
+    first, second = SQLiteCache(path), SQLiteCache(path)
+    assert first.get_or_compute("k", lambda: calls.append(1) or "v", ttl=60) == "v"
+    assert second.get_or_compute("k", lambda: calls.append(1) or "other", ttl=60) == "v"
+    assert len(calls) == 1
+    assert second.acquire("lock", timeout=5)
+    assert not first.acquire("lock", timeout=5)
+    second.release("lock")
+    assert first.acquire("lock", timeout=5)
+
+
+def test_export_csv_pages_through_gateway(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+
+    events = sample_events(5)
+    pages = []
+
+    def fake_request(endpoint, req):
+        pages.append(req["page"])
+        start = req["page"] * req["page_size"]
+        return 200, {"message": {"data": events[start:start + req["page_size"]]}}
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    monkeypatch.setattr(app_module, "EXPORT_PAGE_SIZE", 2)
+    with client.session_transaction() as sess:
+        sess["user_type"] = "venue"
+        sess["user_id"] = "venue"
+    response = client.get("/events/export.csv")
+    assert response.is_streamed
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines[0].startswith("event_id,event_name")
+    assert len(lines) == 6
+    assert pages == [0, 1, 2]
+
+
+def test_iter_pages_stops_when_paging_is_ignored():
+    from .services.exports import iter_pages
+
+    fetched = []
+
+    def same_page(page, page_size):
+        fetched.append(page)
+        return sample_events(3)
+
+    assert [event["event_id"] for event in iter_pages(same_page, 3)] == ["0", "1", "2"]
+    assert fetched == [0, 1]
+
+    def endless(page, page_size):
+        fetched.append(page)
+        return sample_events(page_size * (page + 1))[-page_size:]
+
+    fetched.clear()
+    assert len(list(iter_pages(endless, 3, max_pages=4))) == 12
+    assert fetched == [0, 1, 2, 3]
+
+
+def test_ics_export_folds_long_lines():
+    from .services.exports import ics_lines
+
+    event = dict(sample_events(1)[0], event_name="A very long event name " * 5)
+    calendar = "".join(ics_lines([event]))
+    assert calendar.startswith("BEGIN:VCALENDAR\r\n")
+    assert "DTSTART:20240501T200000" in calendar
+    assert all(len(line.encode()) <= 75 for line in calendar.split("\r\n"))
+
+
+def test_venue_dashboard_updates_incrementally():
+    from datetime import date
+    from .services.sales_dashboard import VenueDashboard
+
+    events = sample_events(3)
+    for event in events:
+        event["price"] = "10"
+    dashboard = VenueDashboard(events)
+    assert dashboard.summary()["sold"] == 30
+    dashboard.record_reservation("1", 4)
+    dashboard.record_purchase("1", 4)
+    dashboard.add_event(dict(events[0], event_id="early", date_time="2024-04-30T19:00:00", sold_tickets=0))
+    dashboard.remove_event("2")
+    summary = dashboard.summary()
+    assert summary["sold"] == 24
+    assert summary["reserved"] == 0
+    assert summary["revenue"] == 240.0
+    assert [day["date"] for day in summary["days"]] == [date(2024, 4, 30), date(2024, 5, 1), date(2024, 5, 2)]
+    assert [day["sold"] for day in summary["days"]] == [0, 10, 14]
+
+
+def test_dashboard_route_builds_once(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+
+    requests_made = []
+
+    def fake_request(endpoint, req):
+        requests_made.append(endpoint)
+        return 200, {"message": {"data": sample_events(4)}}
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    with client.session_transaction() as sess:
+        sess["user_type"] = "venue"
+        sess["user_id"] = "dashboard-venue"
+    assert b"Event 3" in client.get("/dashboard").data
+    client.get("/dashboard")
+    assert requests_made == ["/get_events_for_venue"]
+
+
+def test_profiler_captures_slow_requests_and_stacks(client, monkeypatch):
+    import time
+    from . import app as app_module
+
+    def slow_gateway(endpoint, req):
+        time.sleep(0.05)
+        return 200, {"message": {"data": sample_events(3)}}
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(app_module, "make_authorized_request", slow_gateway)
+    monkeypatch.setattr(app_module.profiler, "slow_ms", 20)
+    monkeypatch.setattr(app_module.profiler, "interval", 0.001)
+    admin = {"Authorization": "Bearer secret"}
+    try:
+        client.post("/admin/profiler", data={"seconds": 5, "route": "search"}, headers=admin)
+        choose_country(client, "Profiled City")
+        response = client.post("/search", data={"city": "Profiled City"})
+        assert b"Event 1" in response.data
+        response.close()  # servers close the response once it's sent, the test client leaves that to us
+        profile = client.get("/admin/profiler/profile.txt", headers=admin).get_data(as_text=True)
+        assert "slow_gateway" in profile
+        slow = client.get("/admin/profiler/slow", headers=admin).get_json()
+        assert slow[-1]["endpoint"] == "search"
+        assert slow[-1]["duration_ms"] >= 50 and "parse" in slow[-1]["phases_ms"]
+        # The listing is streamed, its rendering still counts
+        assert slow[-1]["phases_ms"]["template"] > 0
+        assert slow[-1]["duration_ms"] >= sum(slow[-1]["phases_ms"].values())
+    finally:
+        app_module.profiler.disable()
+
+
+def test_memory_accounting_samples_routes_and_enforces_session_budget(client, monkeypatch):
+    from . import app as app_module
+    import secrets
+    from .utils.memory import SESSION_REJECT
+
+    def fake_gateway(endpoint, req):
+        return 200, {"message": {"data": sample_events(3)}}
+
+    accounting = app_module.memory_accounting
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_gateway)
+    monkeypatch.setattr(accounting, "sample_rate", 1.0)
+    monkeypatch.setattr(accounting, "session_budget", 500)
+    # Session cookies are compressed, so the oversized value has to be incompressible
+    oversized_city = secrets.token_hex(400)
+    choose_country(client, "Small City", oversized_city)
+    assert b"Event 1" in client.post("/search", data={"city": "Small City"}).data
+
+    monkeypatch.setattr(accounting, "session_action", SESSION_REJECT)
+    response = client.post("/search", data={"city": oversized_city})
+    assert response.status_code == 500
+    with client.session_transaction() as sess:
+        assert sess["city"] == "Small City", "Oversized session was saved"
+
+    memory = client.get("/metrics", headers={"Authorization": "Bearer secret"}).get_json()["memory"]
+    assert memory["peak_alloc_bytes"]["search"]["count"] >= 2
+    assert memory["peak_alloc_bytes"]["search"]["p95"] > 0
+    assert memory["session_bytes"]["search"]["max"] > 500
+    assert memory["oversized_sessions"] >= 1
+
+
+def test_requests_are_traced_and_propagate_trace_id(client, monkeypatch):
+    from . import app as app_module
+    from . import auth
+
+    sent_headers = []
+
+    class FakeResponse:
+        status_code = 200
+
+        def json(self):
+            return {"message": {"data": sample_events(2)}}
+
+    def fake_post(url, headers=None, json=None, timeout=None):
+        sent_headers.append(headers)
+        return FakeResponse()
+
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(auth, "get_token", lambda: "token")
+    monkeypatch.setattr(auth.gateway_session, "post", fake_post)
+    monkeypatch.setattr(app_module, "make_authorized_request", auth.make_authorized_request)
+    incoming = "00-" + "a" * 32 + "-" + "b" * 16 + "-01"
+    choose_country(client, "Traced City")
+    response = client.post("/search", data={"city": "Traced City"}, headers={"traceparent": incoming})
+    assert b"Event 1" in response.data
+    assert response.headers["X-Trace-Id"] == "a" * 32
+    assert sent_headers[0]["traceparent"].startswith("00-" + "a" * 32 + "-")
+
+    admin = {"Authorization": "Bearer secret"}
+    trace = client.get("/admin/traces/" + "a" * 32, headers=admin).get_json()
+    spans = {span["name"]: span for span in trace["spans"]}
+    assert trace["name"] == "search" and spans["search"]["parent_id"] == "b" * 16
+    assert spans["make_jwt_request"]["attrs"]["endpoint"] == "/get_events_in_city"
+    assert spans["sanitize"]["parent_id"] == spans["search"]["span_id"]
+    assert sent_headers[0]["traceparent"].endswith(spans["make_jwt_request"]["span_id"] + "-01")
+    assert trace["critical_path"][0] == spans["search"]["span_id"]
+    listed = client.get("/admin/traces?endpoint=search", headers=admin).get_json()
+    assert listed[0]["trace_id"] == "a" * 32
+
+
+def wait_for_prefetches(prefetcher, timeout=2.0):
+    import time
+
+    deadline = time.monotonic() + timeout
+    while prefetcher.stats()["pending"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_prefetches_next_page_and_popular_cities(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+
+    requests_made = []
+
+    def fake_request(endpoint, req):
+        requests_made.append(req["identifier"])
+        return 200, {"message": {"data": sample_events(30)}}
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    with client.session_transaction() as sess:
+        sess["logged_in"] = True
+        sess["user_type"] = "attendee"
+        sess["country"] = "Norway"
+        sess["city"] = "Paged City"
+
+    # Entry still has most of its TTL left, so the next page doesn't refetch it
+    client.get("/events").data
+    wait_for_prefetches(app_module.prefetcher)
+    assert requests_made == ["Paged City"]
+    # Near expiry it's refreshed in the background while page 1 is read
+    monkeypatch.setattr(app_module, "PREFETCH_REFRESH_WINDOW", 3600)
+    client.get("/events").data
+    wait_for_prefetches(app_module.prefetcher)
+    assert requests_made == ["Paged City", "Paged City"]
+    # No next page after the last one
+    client.get("/events?page=2").data
+    wait_for_prefetches(app_module.prefetcher)
+    assert len(requests_made) == 2
+
+    choose_country(client, "Popular City", "Quiet City", country="Norway")
+    for city in ["Popular City", "Popular City", "Quiet City"]:
+        client.post("/search", data={"city": city}).data
+    wait_for_prefetches(app_module.prefetcher)
+    requests_made.clear()
+    app_module.shared_cache.clear()
+    monkeypatch.setattr(app_module.city_index, "get", lambda country: None)
+    monkeypatch.setattr(app_module, "PREFETCH_TOP_CITIES", 1)
+    client.post("/search", data={"country": "Norway"})
+    wait_for_prefetches(app_module.prefetcher)
+    assert requests_made == ["Popular City"]
+    assert app_module.shared_cache.get("events:Popular City") is not None
+
+
+def test_bulk_reschedule_reports_per_event_outcomes(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+    from .services.event_index import EventSearchIndex
+
+    calls = []
+
+    def fake_request(endpoint, req):
+        calls.append((endpoint, req))
+        if req["event_id"] == "2":
+            return 500, "Gateway error"
+        return 200, {"message": "Updated"}
+
+    city_events = sample_events(3)
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    app_module.event_indexes.put("Bulk City", EventSearchIndex(city_events))
+    app_module.shared_cache.set("events:Bulk City", city_events, 60)
+    with client.session_transaction() as sess:
+        sess["user_type"] = "venue"
+        sess["user_id"] = "venue"
+        # As stored by /events, after annotate_event_dates
+        sess["user_events"] = [
+            {"event_id": str(i), "event_name": f"Event {i}", "date": "Wed, 01 May 2024 00:00:00 GMT", "time": "19:30"}
+            for i in range(3)
+        ] + [{"event_id": "3", "event_name": "Undated"}]
+
+    response = client.post(
+        "/events/bulk", json={"operation": "reschedule", "shift_days": 7, "event_ids": ["0", "2", "9", "3"]}
+    )
+    body = response.get_json()
+    assert (body["succeeded"], body["failed"]) == (1, 3)
+    assert [result["status"] for result in body["results"]] == [200, 500, 403, 400]
+    # The calls run concurrently, so compare them by event rather than in order
+    sent = {req["event_id"]: (endpoint, req["update_attrs"]) for endpoint, req in calls}
+    assert sent["0"] == ("/update_event", {"event_date": "2024-05-08", "event_time": "19:30"})
+    assert len(calls) == 2 and set(sent) == {"0", "2"}, "Event the venue doesn't own was sent to the gateway"
+    assert app_module.event_indexes.peek("Bulk City").events["0"]["date_time"] == "2024-05-08T19:30:00"
+    assert app_module.shared_cache.get("events:Bulk City") is None
+    with client.session_transaction() as sess:
+        assert sess["user_events"][0]["date"] == "Wed, 08 May 2024 00:00:00 GMT"
+        assert sess["user_events"][2]["date"] == "Wed, 01 May 2024 00:00:00 GMT"
+
+    assert client.post("/events/bulk", json={"operation": "explode", "event_ids": ["0"]}).status_code == 400
+
+
+def test_bulk_reprice_keeps_events_on_the_dashboard(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+    from .services.sales_dashboard import VenueDashboard
+
+    dashboard = VenueDashboard([dict(event, price="10.00") for event in sample_events(2)])
+    dashboard.record_purchase("1", 2)
+    monkeypatch.setattr(app_module, "make_authorized_request", lambda endpoint, req: (200, {"message": "Updated"}))
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    app_module.venue_dashboards.put("reprice-venue", dashboard)
+    with client.session_transaction() as sess:
+        sess["user_type"] = "venue"
+        sess["user_id"] = "reprice-venue"
+        # No date_time, /events pops it
+        sess["user_events"] = [
+            {"event_id": str(i), "event_name": f"Event {i}", "date": "Thu, 02 May 2024 00:00:00 GMT", "time": "20:00"}
+            for i in range(2)
+        ]
+
+    body = client.post("/events/bulk", json={"operation": "reprice", "price": 25, "event_ids": ["1"]}).get_json()
+    assert body["succeeded"] == 1
+    events = {event["event_id"]: event for event in dashboard.summary()["events"]}
+    assert set(events) == {"0", "1"}
+    # Tickets already sold keep their price, later ones sell at the new one
+    assert (events["1"]["sold"], events["1"]["revenue"], events["1"]["price"]) == (12, 120.0, 25.0)
+    dashboard.record_purchase("1", 1)
+    assert dashboard.summary()["events"][1]["revenue"] == 145.0
+
+    monkeypatch.setattr(app_module, "make_authorized_request", lambda endpoint, req: (400, "Unknown attribute"))
+    body = client.post("/events/bulk", json={"operation": "reprice", "price": 5, "event_ids": ["0"]}).get_json()
+    assert body["results"][0]["error"].startswith("The gateway doesn't accept price changes")
+    assert dashboard.summary()["events"][0]["price"] == 10.0
+
+    monkeypatch.setattr(app_module, "make_authorized_request", lambda endpoint, req: (200, {"message": "Updated"}))
+    client.post("/events/bulk", json={"operation": "reschedule", "shift_days": 30, "event_ids": ["1"]})
+    moved = dashboard.summary()["events"][-1]
+    assert (moved["event_id"], str(moved["date"]), moved["sold"]) == ("1", "2024-06-01", 13)
+
+
+def test_my_tickets_renders_qr_codes_and_cached_pdf(client, monkeypatch, tmp_path):
+    import re
+    from types import SimpleNamespace
+    from . import app as app_module
+    from .services.tickets import TicketRenderer
+
+    calls = []
+
+    def fake_request(endpoint, req):
+        calls.append(endpoint)
+        tickets = [
+            {"ticket_id": f"t{i}", "event_id": "e1", "event_name": "Gig (Live)", "date_time": "2024-05-01T19:30:00"}
+            for i in range(3)
+        ]
+        return 200, {"message": {"data": tickets}}
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    monkeypatch.setattr(app_module, "ticket_renderer", TicketRenderer(str(tmp_path), max_workers=2))
+    with client.session_transaction() as sess:
+        sess["user_type"] = "attendee"
+        sess["user_id"] = "attendee-1"
+
+    page = client.get("/tickets").get_data(as_text=True)
+    assert "/tickets/t0/qr.svg" in page and "/tickets/t2/qr.svg" in page
+    qr = client.get("/tickets/t1/qr.svg")
+    assert qr.mimetype == "image/svg+xml" and qr.data.startswith(b"<svg")
+    assert client.get("/tickets/t1/qr.svg", headers={"If-None-Match": qr.headers["ETag"]}).status_code == 304
+    assert client.get("/tickets/someone-elses/qr.svg").status_code == 404
+
+    pdf = client.get("/tickets/tickets.pdf")
+    assert pdf.mimetype == "application/pdf" and pdf.data.startswith(b"%PDF-1.4")
+    assert len(re.findall(rb"/Type /Page ", pdf.data)) == 3
+    assert b"(Gig \\(Live\\)) Tj" in pdf.data
+    # Served from the content-addressed cache without rendering again
+    assert len(list(tmp_path.glob("*.page"))) == 3
+    monkeypatch.setattr(app_module.ticket_renderer, "pool", None)
+    assert client.get("/tickets/tickets.pdf").data == pdf.data
+    assert calls == ["/get_tickets_for_attendee"], "Ticket list wasn't cached"
+
+
+def test_city_grid_radius_queries_wrap_the_antimeridian():
+    from .services.nearby_cities import CityGrid
+
+    grid = CityGrid(
+        [
+            {"city": "East", "lat": -17.0, "lng": 179.9},
+            {"city": "West", "lat": -17.0, "lng": -179.9},
+            {"city": "Far", "lat": -17.0, "lng": 178.0},
+            {"city": "Unknown", "lat": None, "lng": None},
+        ]
+    )
+    assert len(grid) == 3
+    assert [name for _, name in grid.within(-17.0, 179.9, 50)] == ["East", "West"]
+    assert [name for _, name in grid.within(-17.0, -179.9, 250)] == ["West", "East", "Far"]
+
+
+def test_nearby_events_merges_cities_within_radius_by_date(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+
+    coordinates = [
+        {"city": "Avonmouth", "lat": 51.50, "lng": -2.70},
+        {"city": "Bath", "lat": 51.38, "lng": -2.36},
+        {"city": "Cardiff", "lat": 51.48, "lng": -3.18},
+    ]
+    events = {
+        "Avonmouth": [{"event_id": "b1", "event_name": "Avonmouth late", "date_time": "2024-05-03T20:00:00"},
+                      {"event_id": "b2", "event_name": "Avonmouth early", "date_time": "2024-05-01T20:00:00"}],
+        "Bath": [{"event_id": "a1", "event_name": "Bath middle", "date_time": "2024-05-02T20:00:00"}],
+        "Cardiff": [{"event_id": "c1", "event_name": "Cardiff", "date_time": "2024-05-02T19:00:00"}],
+    }
+    fetched = []
+
+    def fake_request(endpoint, req):
+        fetched.append(req["identifier"])
+        if endpoint == "/get_city_coordinates":
+            return 200, {"message": {"data": coordinates}}
+        return 200, {"message": {"data": events[req["identifier"]]}}
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    with client.session_transaction() as sess:
+        sess["user_type"] = "attendee"
+        sess["country"] = "Nearbyland"
+        sess["city"] = "Avonmouth"
+
+    page = client.get("/events/nearby?km=30").get_data(as_text=True)
+    assert "within 30 km of Avonmouth (Avonmouth, Bath)" in page
+    positions = [page.index(name) for name in ["Avonmouth early", "Bath middle", "Avonmouth late"]]
+    assert positions == sorted(positions)
+    assert "Cardiff<" not in page
+    assert sorted(fetched) == ["Avonmouth", "Bath", "Nearbyland"]
+
+
+def test_benchmark_comparison_flags_regressions_over_threshold():
+    from .tests.benchmarks import compare
+
+    baseline = {"benchmarks": {"fast": {"min_us": 10.0}, "slow": {"min_us": 100.0}, "gone": {"min_us": 1.0}}}
+    results = {"fast": {"min_us": 12.0}, "slow": {"min_us": 140.0}, "new": {"min_us": 5.0}}
+    assert compare(results, baseline, threshold=0.25) == [("fast", 1.2, False), ("slow", 1.4, True)]
+    assert compare(results, baseline, 0.25, overrides={"slow": 0.5})[1] == ("slow", 1.4, False)
+
+
+def test_purchase_is_idempotent_across_double_submits_and_retries(client, monkeypatch):
+    from types import SimpleNamespace
+    from . import app as app_module
+
+    calls = []
+    responses = [(503, "timeout"), (200, {"message": "ok"})]
+
+    def fake_request(endpoint, req):
+        calls.append((endpoint, req["idempotency_key"]))
+        return responses.pop(0) if responses else (500, "charged twice")
+
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+
+    def submit():
+        with client.session_transaction() as sess:
+            sess["user_type"] = "attendee"
+            sess["user_id"] = "attendee-idem"
+            sess["event_info"] = {"event_event_id": "e1", "event_venue_id": "v1"}
+            sess["ticket_ids"] = ["t2", "t1"]
+        return client.post("/purchase_ticket/e1")
+
+    submit()  # the gateway timed out, nothing is stored so the retry calls again
+    submit()
+    submit()  # a double submit replays the confirmed purchase
+    assert [endpoint for endpoint, _ in calls] == ["/purchase_tickets", "/purchase_tickets"]
+    assert calls[0][1] == calls[1][1], "Retries must reuse the idempotency key"
+    with client.session_transaction() as sess:
+        assert "ticket_ids" not in sess
+
+
+def test_idempotent_call_never_runs_twice_when_the_lock_times_out():
+    from .services.idempotency import IdempotencyStore
+    from .utils.cache import MemoryCache
+
+    cache = MemoryCache()
+    store = IdempotencyStore(cache, lock_timeout=0.05)
+    calls = []
+
+    def purchase():
+        calls.append("/purchase_tickets")
+        return 200, "ok"
+
+    # The first call is still running (or its worker died) and holds the key's lock
+    assert cache.acquire("idempotency:purchase:k", 60)
+    status_code, _, replayed = store.run("purchase", "k", purchase)
+    assert (status_code, replayed, calls) == (503, False, [])
+
+
+def test_idempotent_call_keeps_its_lock_while_it_outlives_lock_timeout():
+    import threading
+    import time
+    from .services.idempotency import IdempotencyStore
+    from .utils.cache import MemoryCache
+
+    store = IdempotencyStore(MemoryCache(), lock_timeout=0.3)
+    calls = []
+
+    def slow_purchase():
+        calls.append("/purchase_tickets")
+        time.sleep(0.5)
+        return 200, "ok"
+
+    first = threading.Thread(target=store.run, args=("purchase", "k", slow_purchase))
+    first.start()
+    time.sleep(0.1)
+    # Waits past lock_timeout while the first call still runs, and must not call again
+    assert store.run("purchase", "k", slow_purchase)[0] == 503
+    first.join()
+    assert store.run("purchase", "k", slow_purchase) == (200, "ok", True)
+    assert calls == ["/purchase_tickets"]
+
+
+def test_purchase_queue_claims_one_purchase_at_a_time_and_skips_replays(tmp_path):
+    from .services.purchase_queue import PurchaseQueue, CONFIRMED
+
+    settled = []
+    unclaimed_while_sending = []
+
+    def send(payload):
+        # Nothing else is claimed while this purchase is being sent
+        unclaimed = queue.connection().execute("SELECT COUNT(*) FROM purchases WHERE claimed_until = 0")
+        unclaimed_while_sending.append(unclaimed.fetchone()[0])
+        return 200, "ok", payload["key"] == "replayed"
+
+    queue = PurchaseQueue(str(tmp_path / "purchases.sqlite3"), send, lambda payload, status: settled.append(payload))
+    queue.start = lambda: None
+    for key in ["replayed", "fresh"]:
+        queue.enqueue(key, {"key": key})
+    assert queue.flush() == 2
+    assert unclaimed_while_sending == [1, 0]
+    assert queue.get("replayed")["status"] == queue.get("fresh")["status"] == CONFIRMED
+    assert settled == [{"key": "fresh"}], "A replayed confirmation was recorded twice"
+
+
+def test_async_purchase_is_queued_and_confirmed_in_batches(client, monkeypatch, tmp_path):
+    from types import SimpleNamespace
+    from . import app as app_module
+    from .services.purchase_queue import PurchaseQueue
+
+    calls = []
+
+    def fake_request(endpoint, req):
+        calls.append(req["ticket_ids"])
+        return 200, {"message": "ok"}
+
+    queue = PurchaseQueue(
+        str(tmp_path / "purchases.sqlite3"), send=app_module.send_purchase, on_result=app_module.settle_purchase
+    )
+    monkeypatch.setattr(queue, "start", lambda: None)  # flushed by hand below
+    monkeypatch.setattr(app_module, "purchase_queue", queue)
+    monkeypatch.setattr(app_module, "PURCHASE_CONFIRMATION", "async")
+    monkeypatch.setattr(app_module, "make_authorized_request", fake_request)
+    monkeypatch.setattr(app_module, "google", SimpleNamespace(authorized=True))
+    with client.session_transaction() as sess:
+        sess["user_type"] = "attendee"
+        sess["user_id"] = "attendee-async"
+        sess["event_info"] = {"event_event_id": "e1", "event_venue_id": "v1"}
+        sess["ticket_ids"] = ["t1", "t2"]
+
+    response = client.post("/purchase_ticket/e1")
+    assert response.status_code == 302 and "/purchases/" in response.location
+    status_url = response.location + "/status"
+    assert client.get(status_url).get_json() == {"status": "pending"}
+    assert "confirming your 2 ticket(s)" in client.get(response.location).get_data(as_text=True)
+    assert calls == []
+
+    assert queue.flush() == 1
+    assert calls == [["t1", "t2"]]
+    assert client.get(status_url).get_json() == {"status": "confirmed"}
+    assert queue.stats() == {"confirmed": 1}
+    with client.session_transaction() as sess:
+        sess["user_id"] = "someone-else"
+    assert client.get(status_url).status_code == 404
@@ -1,11 +1,50 @@
 import requests
+from requests.adapters import HTTPAdapter
 from google.oauth2 import service_account  # type: ignore
 from google.auth.transport.requests import Request  # type: ignore
 import os
 import json
+import threading
+import time
+from typing import Dict
+from .utils.circuit_breaker import CircuitBreaker
+from .utils.cache import shared_cache
+from .utils.profiling import phase
+from .utils.tracing import span, trace_headers
+from .utils.workers import worker_threads
 
+# Size the connection pool to the number of threads a worker can run so that
+# concurrent requests reuse keep-alive connections to the gateway.
+GATEWAY_POOL_SIZE = int(os.environ.get("GATEWAY_POOL_SIZE", worker_threads()))
+GATEWAY_TIMEOUT = float(os.environ.get("GATEWAY_TIMEOUT", "30"))
+# ID tokens are valid for an hour, share them between workers for a bit less than that
+GATEWAY_TOKEN_TTL = int(os.environ.get("GATEWAY_TOKEN_TTL", "3000"))
 
-def get_token():
+gateway_session = requests.Session()
+gateway_session.mount(
+    "https://", HTTPAdapter(pool_connections=GATEWAY_POOL_SIZE, pool_maxsize=GATEWAY_POOL_SIZE)
+)
+gateway_session.mount(
+    "http://", HTTPAdapter(pool_connections=GATEWAY_POOL_SIZE, pool_maxsize=GATEWAY_POOL_SIZE)
+)
+
+
+class GatewayError(Exception):
+    """Raised when the gateway answers a request with a non-200 status"""
+
+    def __init__(self, status_code, message=""):
+        super().__init__(f"Gateway returned {status_code}: {message}")
+        self.status_code = status_code
+
+
+_credentials = None
+_credentials_lock = threading.Lock()
+
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+_circuit_breakers_lock = threading.Lock()
+
+
+def load_credentials():
     service_account_json_string = os.environ.get("SERVICE_ACCOUNT_JSON")
     if service_account_json_string is None:
         sa_dict = {
@@ -27,12 +66,53 @@ def get_token():
         service_account_json_string = json.dumps(sa_dict)
         print(sa_dict)
     service_account_info = json.loads(service_account_json_string)
-    credentials = service_account.IDTokenCredentials.from_service_account_info(
+    return service_account.IDTokenCredentials.from_service_account_info(
         service_account_info,
         target_audience=os.environ.get("GATEWAY_HOST"),
     )
-    credentials.refresh(Request())
-    return credentials.token
+
+
+def refresh_token():
+    global _credentials
+    with _credentials_lock:
+        if _credentials is None:
+            _credentials = load_credentials()
+        _credentials.refresh(Request())
+        return _credentials.token
+
+
+def get_token():
+    """Returns an ID token for the gateway. Tokens are shared between the workers on the
+    host through the shared cache, so only one of them refreshes it when it expires"""
+    with span("get_token") as current:
+        credentials = _credentials
+        if credentials is not None and credentials.valid:
+            return credentials.token
+        if current is not None:
+            current.set(source="shared_cache")
+        return shared_cache.get_or_compute("gateway_token", refresh_token, GATEWAY_TOKEN_TTL)
+
+
+def token_is_warm():
+    """True when a gateway token is cached and has not expired"""
+    credentials = _credentials
+    if credentials is not None and credentials.valid:
+        return True
+    return shared_cache.get("gateway_token") is not None
+
+
+def get_circuit_breaker(endpoint_path):
+    with _circuit_breakers_lock:
+        breaker = circuit_breakers.get(endpoint_path)
+        if breaker is None:
+            breaker = circuit_breakers[endpoint_path] = CircuitBreaker(
+                error_rate=float(os.environ.get("GATEWAY_CB_ERROR_RATE", "0.5")),
+                min_calls=int(os.environ.get("GATEWAY_CB_MIN_CALLS", "10")),
+                window=int(os.environ.get("GATEWAY_CB_WINDOW", "20")),
+                slow_call_seconds=float(os.environ.get("GATEWAY_CB_SLOW_CALL", "5")),
+                reset_timeout=float(os.environ.get("GATEWAY_CB_RESET_TIMEOUT", "30")),
+            )
+        return breaker
 
 
 def make_jwt_request(
@@ -41,21 +121,44 @@ def make_jwt_request(
     host = os.environ.get("GATEWAY_HOST")
     """Makes an authorized request to the endpoint"""
 
+    if request_type not in ("GET", "POST", "PUT", "DELETE"):
+        raise ValueError(f"Unsupported request_type: {request_type}")
+    with span("make_jwt_request", endpoint=endpoint_path, method=request_type) as current:
+        status_code, content = _make_jwt_request(
+            signed_jwt, host, endpoint_path, request, request_type, raise_for_status
+        )
+        if current is not None:
+            current.set(status=status_code)
+        return status_code, content
+
+
+def _make_jwt_request(signed_jwt, host, endpoint_path, request, request_type, raise_for_status):
     headers = {
         "Authorization": f"Bearer {signed_jwt}",
         "content-type": "application/json",
+        **trace_headers(),
     }
     url = f"{host}{endpoint_path}"
-    if request_type == "GET":
-        response = requests.get(url, headers=headers, params=request)
-    elif request_type == "POST":
-        response = requests.post(url, headers=headers, json=request)
-    elif request_type == "PUT":
-        response = requests.put(url, headers=headers, json=request)
-    elif request_type == "DELETE":
-        response = requests.delete(url, headers=headers, json=request)
-    else:
-        raise ValueError(f"Unsupported request_type: {request_type}")
+    # Fail fast while the endpoint's circuit is open instead of tying up the worker
+    breaker = get_circuit_breaker(endpoint_path)
+    if not breaker.allow():
+        if raise_for_status:
+            raise GatewayError(503, f"Circuit open for {endpoint_path}")
+        return 503, f"Circuit open for {endpoint_path}"
+    start = time.monotonic()
+    ok = False
+    try:
+        if request_type == "GET":
+            response = gateway_session.get(url, headers=headers, params=request, timeout=GATEWAY_TIMEOUT)
+        elif request_type == "POST":
+            response = gateway_session.post(url, headers=headers, json=request, timeout=GATEWAY_TIMEOUT)
+        elif request_type == "PUT":
+            response = gateway_session.put(url, headers=headers, json=request, timeout=GATEWAY_TIMEOUT)
+        else:
+            response = gateway_session.delete(url, headers=headers, json=request, timeout=GATEWAY_TIMEOUT)
+        ok = response.status_code < 500
+    finally:
+        breaker.record(ok, time.monotonic() - start)
     if raise_for_status:
         response.raise_for_status()
     else:
@@ -67,10 +170,12 @@ def make_jwt_request(
 def make_authorized_request(
     endpoint_path, request, request_type="POST", raise_for_status=False
 ):
-    token = get_token()
-    return make_jwt_request(
-        token, endpoint_path, request, request_type, raise_for_status=raise_for_status
-    )
+    with phase("token"):
+        token = get_token()
+    with phase("gateway"):
+        return make_jwt_request(
+            token, endpoint_path, request, request_type, raise_for_status=raise_for_status
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,46 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class CatalogSnapshot:
+    """Last good copy of gateway catalog reads (events by city, cities by country),
+    kept as one JSON file per key so read routes can still answer while the
+    gateway is down. Saves of the same key are throttled to one per min_interval."""
+
+    def __init__(self, directory, min_interval=60):
+        self.directory = directory
+        self.min_interval = min_interval
+        self.saved_at = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, kind, key):
+        digest = hashlib.sha1(str(key).encode()).hexdigest()
+        return os.path.join(self.directory, f"{kind}-{digest}.json")
+
+    def save(self, kind, key, data):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.saved_at.get((kind, key), -self.min_interval) < self.min_interval:
+                return
+            self.saved_at[(kind, key)] = now
+        # Write to a temporary file first so readers never see a partial snapshot
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump({"key": key, "saved_at": time.time(), "data": data}, f)
+            os.replace(tmp_path, self.path(kind, key))
+        except (OSError, TypeError, ValueError):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def load(self, kind, key):
+        try:
+            with open(self.path(kind, key)) as f:
+                return json.load(f)["data"]
+        except (OSError, ValueError, KeyError):
+            return None
@@ -0,0 +1,28 @@
+from bisect import bisect_left
+
+
+class PrefixIndex:
+    """Sorted-array index answering case-insensitive prefix queries with a binary search"""
+
+    def __init__(self, names, stale=False):
+        self.stale = stale
+        pairs = sorted({(name.casefold(), name) for name in names if name})
+        self.keys = [key for key, _ in pairs]
+        self.names = [name for _, name in pairs]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        i = bisect_left(self.keys, name.casefold())
+        return i < len(self.keys) and self.names[i] == name
+
+    def suggest(self, prefix, limit=10):
+        prefix = prefix.casefold()
+        start = bisect_left(self.keys, prefix)
+        matches = []
+        for i in range(start, min(start + limit, len(self.keys))):
+            if not self.keys[i].startswith(prefix):
+                break
+            matches.append(self.names[i])
+        return matches
@@ -0,0 +1,26 @@
+import threading
+from collections import Counter
+
+
+class CityViews:
+    """Counts which cities attendees pick in each country, to guess the next pick.
+    Each country keeps at most max_cities counters, the least viewed are dropped."""
+
+    def __init__(self, max_cities=200):
+        self.max_cities = max_cities
+        self.views = {}
+        self.lock = threading.Lock()
+
+    def record(self, country, city):
+        if not country or not city:
+            return
+        with self.lock:
+            counts = self.views.setdefault(country, Counter())
+            counts[city] += 1
+            if len(counts) > 2 * self.max_cities:
+                self.views[country] = Counter(dict(counts.most_common(self.max_cities)))
+
+    def top(self, country, n=3):
+        with self.lock:
+            counts = self.views.get(country)
+            return [city for city, _ in counts.most_common(n)] if counts else []
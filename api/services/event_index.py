@@ -0,0 +1,158 @@
+import re
+import threading
+from bisect import bisect_left, bisect_right, insort
+
+TOKEN_PATTERN = re.compile(r"\w+")
+TEXT_FIELDS = ("event_name", "artist_ids", "artist_name", "genre", "genres")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(str(text).casefold())
+
+
+def event_tokens(event):
+    tokens = set()
+    for field in TEXT_FIELDS:
+        value = event.get(field)
+        if not value:
+            continue
+        if isinstance(value, (list, tuple)):
+            for item in value:
+                tokens.update(tokenize(item))
+        else:
+            tokens.update(tokenize(value))
+    return tokens
+
+
+def event_price(event):
+    try:
+        return float(event.get("price"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EventSearchIndex:
+    """In-memory search over one city's events.
+
+    Text is served from an inverted index of event name, artist and genre tokens,
+    with every query term matched as a prefix through a sorted token list. A
+    sorted list of (date_time, event_id) answers date ranges with bisect. Events
+    can be added, updated and removed without rebuilding the index. stale marks
+    an index built from a catalog snapshot rather than a live gateway read."""
+
+    def __init__(self, events=(), stale=False):
+        self.stale = stale
+        self.lock = threading.Lock()
+        self.events = {}
+        self.postings = {}
+        self.tokens = []
+        self.dates = []
+        for event in events:
+            self._add(event)
+
+    def __len__(self):
+        return len(self.events)
+
+    def __contains__(self, event_id):
+        return event_id in self.events
+
+    def add(self, event):
+        with self.lock:
+            self._remove(event["event_id"])
+            self._add(event)
+
+    def update(self, event_id, attributes):
+        with self.lock:
+            event = self.events.get(event_id)
+            if event is None:
+                return False
+            self._remove(event_id)
+            self._add(dict(event, **attributes))
+            return True
+
+    def remove(self, event_id):
+        with self.lock:
+            return self._remove(event_id)
+
+    def _add(self, event):
+        if event.get("status") == "Cancelled" or not event.get("date_time"):
+            return
+        event_id = event["event_id"]
+        self.events[event_id] = dict(event)
+        for token in event_tokens(event):
+            postings = self.postings.get(token)
+            if postings is None:
+                postings = self.postings[token] = set()
+                insort(self.tokens, token)
+            postings.add(event_id)
+        insort(self.dates, (event["date_time"], event_id))
+
+    def _remove(self, event_id):
+        event = self.events.pop(event_id, None)
+        if event is None:
+            return False
+        for token in event_tokens(event):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(event_id)
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+        key = (event["date_time"], event_id)
+        i = bisect_left(self.dates, key)
+        if i < len(self.dates) and self.dates[i] == key:
+            del self.dates[i]
+        return True
+
+    def _match_term(self, term):
+        matches = set()
+        i = bisect_left(self.tokens, term)
+        while i < len(self.tokens) and self.tokens[i].startswith(term):
+            matches |= self.postings[self.tokens[i]]
+            i += 1
+        return matches
+
+    def search(self, query="", date_from=None, date_to=None, min_price=None, max_price=None, limit=None):
+        """Returns copies of the matching events sorted by date. date_from and date_to
+        are inclusive ISO dates (YYYY-MM-DD), all terms in query have to match."""
+        with self.lock:
+            matches = None
+            for term in set(tokenize(query)):
+                term_matches = self._match_term(term)
+                matches = term_matches if matches is None else matches & term_matches
+                if not matches:
+                    return []
+
+            lo = bisect_left(self.dates, (date_from,)) if date_from else 0
+            hi = bisect_right(self.dates, (f"{date_to}\uffff",)) if date_to else len(self.dates)
+            if lo >= hi:
+                return []
+            if matches is not None and len(matches) < hi - lo:
+                # Few text matches, sorting them is cheaper than scanning the date range
+                lower, upper = self.dates[lo], self.dates[hi - 1]
+                candidates = [
+                    key
+                    for key in sorted((self.events[event_id]["date_time"], event_id) for event_id in matches)
+                    if lower <= key <= upper
+                ]
+            else:
+                candidates = self.dates[lo:hi]
+
+            results = []
+            for _, event_id in candidates:
+                if matches is not None and event_id not in matches:
+                    continue
+                event = self.events[event_id]
+                if min_price is not None or max_price is not None:
+                    price = event_price(event)
+                    if price is None:
+                        continue
+                    if min_price is not None and price < min_price:
+                        continue
+                    if max_price is not None and price > max_price:
+                        continue
+                results.append(dict(event))
+                if limit is not None and len(results) >= limit:
+                    break
+            return results
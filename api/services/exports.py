@@ -0,0 +1,128 @@
+import csv
+import io
+from datetime import datetime, timedelta, timezone
+
+CSV_COLUMNS = [
+    "event_id",
+    "event_name",
+    "date_time",
+    "status",
+    "artist_ids",
+    "total_tickets",
+    "sold_tickets",
+    "tickets_left",
+]
+
+
+def iter_pages(fetch_page, page_size, first_page=None, max_pages=1000, key=lambda item: item.get("event_id")):
+    """Yields items from fetch_page(page, page_size) until a page comes back short.
+    A page longer than page_size means the upstream ignored paging and sent everything.
+    Items already yielded are skipped, and a full page with nothing new ends the stream
+    too, as does max_pages: an upstream that ignores paging would otherwise be asked
+    for the same page forever."""
+    seen = set()
+    page = 0
+    items = first_page if first_page is not None else fetch_page(page, page_size)
+    while True:
+        new = 0
+        for item in items:
+            item_key = key(item)
+            if item_key is not None:
+                if item_key in seen:
+                    continue
+                seen.add(item_key)
+            new += 1
+            yield item
+        page += 1
+        if len(items) != page_size or not new or page >= max_pages:
+            return
+        items = fetch_page(page, page_size)
+
+
+def csv_rows(events):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def flush():
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    writer.writerow(CSV_COLUMNS)
+    yield flush()
+    for event in events:
+        total = event.get("total_tickets") or 0
+        sold = event.get("sold_tickets") or 0
+        writer.writerow(
+            [
+                event.get("event_id", ""),
+                event.get("event_name", ""),
+                event.get("date_time", ""),
+                event.get("status", ""),
+                ";".join(str(artist) for artist in event.get("artist_ids") or []),
+                total,
+                sold,
+                int(total) - int(sold),
+            ]
+        )
+        yield flush()
+
+
+def ics_escape(text):
+    return (
+        str(text).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+    )
+
+
+def ics_fold(line):
+    # Lines longer than 75 octets continue on the next line after a space (RFC 5545 3.1)
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    parts = []
+    while len(encoded) > 75:
+        cut = 75 if not parts else 74
+        while (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        parts.append(encoded[:cut].decode("utf-8"))
+        encoded = encoded[cut:]
+    parts.append(encoded.decode("utf-8"))
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def ics_lines(events, calendar_name="Jumpstart Events", duration_hours=2):
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield ics_fold("BEGIN:VCALENDAR")
+    yield ics_fold("VERSION:2.0")
+    yield ics_fold("PRODID:-//Jumpstart Events//Events Export//EN")
+    yield ics_fold(f"X-WR-CALNAME:{ics_escape(calendar_name)}")
+    for event in events:
+        if not event.get("date_time"):
+            continue
+        start = datetime.fromisoformat(event["date_time"]).replace(tzinfo=None)
+        end = start + timedelta(hours=duration_hours)
+        status = "CANCELLED" if event.get("status") == "Cancelled" else "CONFIRMED"
+        yield "".join(
+            ics_fold(line)
+            for line in (
+                "BEGIN:VEVENT",
+                f"UID:{event.get('event_id')}@jumpstart-events",
+                f"DTSTAMP:{stamp}",
+                f"DTSTART:{start.strftime('%Y%m%dT%H%M%S')}",
+                f"DTEND:{end.strftime('%Y%m%dT%H%M%S')}",
+                f"SUMMARY:{ics_escape(event.get('event_name', ''))}",
+                f"DESCRIPTION:{ics_escape(export_description(event))}",
+                f"STATUS:{status}",
+                "END:VEVENT",
+            )
+        )
+    yield ics_fold("END:VCALENDAR")
+
+
+def export_description(event):
+    artists = ", ".join(str(artist) for artist in event.get("artist_ids") or [])
+    return (
+        f"Artists: {artists or 'TBC'}\n"
+        f"Tickets sold: {event.get('sold_tickets', 0)} of {event.get('total_tickets', 0)}"
+    )
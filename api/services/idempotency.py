@@ -0,0 +1,54 @@
+import hashlib
+
+from ..utils.cache import LockTimeout
+
+
+class NotStored(Exception):
+    """Carries a result that mustn't be replayed, so the next attempt calls again"""
+
+    def __init__(self, status_code, content):
+        super().__init__(status_code)
+        self.status_code = status_code
+        self.content = content
+
+
+def derive_key(*parts):
+    """Idempotency key for an operation identified by its parts, e.g. a user and their ticket ids"""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class IdempotencyStore:
+    """Makes a gateway call at most once per key and replays its result to repeats.
+
+    Results are kept in the cache backend for ttl seconds, so with the shared SQLite
+    backend a double submit is caught whichever worker it lands on. The first call
+    keeps the key locked for as long as it runs. A repeat that arrives meanwhile waits
+    for its result instead of calling again, and gets a 503 rather than calling itself
+    if that takes longer than lock_timeout. 5xx results aren't stored: the call may not have happened, so a
+    retry goes through (with the same key, which is also sent to the gateway)."""
+
+    def __init__(self, cache, ttl=86400, lock_timeout=60.0):
+        self.cache = cache
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def run(self, scope, key, call):
+        """Returns (status_code, content, replayed) for call() -> (status_code, content)"""
+        ran = []
+
+        def compute():
+            ran.append(True)
+            status_code, content = call()
+            if status_code >= 500:
+                raise NotStored(status_code, content)
+            return [status_code, content]
+
+        try:
+            status_code, content = self.cache.get_or_compute(
+                f"idempotency:{scope}:{key}", compute, self.ttl, self.lock_timeout, exclusive=True
+            )
+        except NotStored as e:
+            return e.status_code, e.content, False
+        except LockTimeout:
+            return 503, "A request with this key is still in progress", False
+        return status_code, content, not ran
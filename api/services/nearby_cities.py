@@ -0,0 +1,66 @@
+import heapq
+import math
+
+EARTH_RADIUS_KM = 6371.0
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class CityGrid:
+    """Grid index of city coordinates for radius queries.
+
+    Cities are bucketed into square cells of cell_km along a meridian. A query only
+    measures the cities in cells that overlap the circle's bounding box, which is
+    widened towards the poles and wraps around the antimeridian. cities is a list of
+    {"city", "lat", "lng"}; rows without usable coordinates are skipped."""
+
+    def __init__(self, cities, stale=False, cell_km=25):
+        self.stale = stale
+        self.cell_degrees = cell_km / KM_PER_DEGREE
+        self.lng_cells = math.ceil(360 / self.cell_degrees)
+        self.cells = {}
+        self.coordinates = {}
+        for row in cities:
+            try:
+                name, lat, lng = row["city"], float(row["lat"]), float(row["lng"])
+            except (KeyError, TypeError, ValueError):
+                continue
+            self.coordinates[name] = (lat, lng)
+            self.cells.setdefault(self._cell(lat, lng), []).append(name)
+
+    def __len__(self):
+        return len(self.coordinates)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_degrees), math.floor((lng + 180) / self.cell_degrees) % self.lng_cells)
+
+    def within(self, lat, lng, km, limit=None):
+        """(distance_km, city) for every city within km of the point, nearest first"""
+        lat_span = km / KM_PER_DEGREE
+        # Degrees of longitude shrink with cos(latitude), use the widest latitude in range
+        widest = min(abs(lat) + lat_span, 90.0)
+        cos_lat = math.cos(math.radians(widest))
+        lng_span = 180.0 if cos_lat < 1e-6 else min(km / (KM_PER_DEGREE * cos_lat), 180.0)
+        row_min, col_min = self._cell(lat - lat_span, lng - lng_span)
+        row_max, _ = self._cell(lat + lat_span, lng + lng_span)
+        # One extra column in case the range crosses the narrower cell at the antimeridian
+        n_cols = min(math.floor(2 * lng_span / self.cell_degrees) + 3, self.lng_cells)
+        found = []
+        for row in range(row_min, row_max + 1):
+            for i in range(n_cols):
+                for name in self.cells.get((row, (col_min + i) % self.lng_cells), ()):
+                    distance = haversine_km(lat, lng, *self.coordinates[name])
+                    if distance <= km:
+                        found.append((distance, name))
+        found.sort()
+        return found[:limit] if limit else found
+
+
+def merge_by_date(event_lists):
+    """Merges lists that are each sorted by date_time into one sorted stream, lazily"""
+    return heapq.merge(*event_lists, key=lambda event: event["date_time"])
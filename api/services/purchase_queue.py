@@ -0,0 +1,152 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ..utils.cache import create_private_file, thread_connection
+
+PENDING = "pending"
+CONFIRMED = "confirmed"
+FAILED = "failed"
+
+
+class PurchaseQueue:
+    """Purchases accepted from users but not yet confirmed with the gateway.
+
+    Kept in a SQLite file shared by the workers on the host, so a purchase survives
+    the worker that took it. A background thread in each worker confirms up to
+    batch_size pending purchases per flush with send(payload) -> (status_code, content,
+    replayed), claiming each one just before sending it so a slow batch can't outlast
+    the claims of its last purchases. Purchases that fail with a 5xx or an exception
+    stay pending and are retried until max_attempts; other errors fail them. A claim
+    expires after claim_timeout, so a worker dying mid-send only delays that purchase.
+    on_result(payload, status) runs once a purchase settles, unless send replayed a
+    result another worker already settled. Settled purchases are kept for `retention`
+    seconds so users can see their status."""
+
+    def __init__(
+        self, path, send, on_result=None, batch_size=20, interval=1.0, max_attempts=5, claim_timeout=60,
+        retention=7 * 86400,
+    ):
+        self.path = path
+        self.send = send
+        self.on_result = on_result
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self.claim_timeout = claim_timeout
+        self.retention = retention
+        self.local = threading.local()
+        self.flusher = None
+        self.flusher_pid = None
+        self.lock = threading.Lock()
+        create_private_file(path)
+        self.connection().execute(
+            "CREATE TABLE IF NOT EXISTS purchases (key TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+            "status TEXT NOT NULL, result TEXT, attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, claimed_until REAL NOT NULL DEFAULT 0)"
+        )
+        self.connection().execute("CREATE INDEX IF NOT EXISTS purchases_status ON purchases (status, created_at)")
+
+    def connection(self):
+        return thread_connection(self.local, self.path)
+
+    def enqueue(self, key, payload):
+        """Adds a purchase unless one with the same idempotency key is already queued"""
+        self.connection().execute(
+            "INSERT OR IGNORE INTO purchases (key, payload, status, created_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(payload), PENDING, time.time()),
+        )
+        self.start()
+
+    def get(self, key):
+        row = self.connection().execute(
+            "SELECT payload, status, result FROM purchases WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"payload": json.loads(row[0]), "status": row[1], "result": json.loads(row[2] or "null")}
+
+    def prune(self):
+        self.connection().execute(
+            "DELETE FROM purchases WHERE status != ? AND created_at < ?", (PENDING, time.time() - self.retention)
+        )
+
+    def claim(self):
+        """Claims the oldest unclaimed pending purchase, returns (key, payload, attempts) or None"""
+        now = time.time()
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT key, payload, attempts FROM purchases WHERE status = ? AND claimed_until <= ? "
+                "ORDER BY created_at LIMIT 1",
+                (PENDING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE purchases SET claimed_until = ?, attempts = attempts + 1 WHERE key = ?",
+                    (now + self.claim_timeout, row[0]),
+                )
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]), row[2] + 1
+
+    def flush(self):
+        """Sends up to batch_size purchases. Returns how many were claimed"""
+        self.prune()
+        claimed = 0
+        while claimed < self.batch_size:
+            item = self.claim()
+            if item is None:
+                break
+            claimed += 1
+            self.settle(*item)
+        return claimed
+
+    def settle(self, key, payload, attempts):
+        try:
+            status_code, content, replayed = self.send(payload)
+        except Exception as e:
+            status_code, content, replayed = 503, str(e), False
+        if status_code == 200:
+            status = CONFIRMED
+        elif status_code < 500 or attempts >= self.max_attempts:
+            status = FAILED
+        else:
+            # Leave it pending, it's claimed again once the claim expires
+            return
+        # A confirmation wins over a failure recorded by a worker that gave up waiting on it
+        settled = self.connection().execute(
+            "UPDATE purchases SET status = ?, result = ? WHERE key = ? AND status IN (?, ?)",
+            (status, json.dumps([status_code, content]), key, PENDING, FAILED if status == CONFIRMED else PENDING),
+        ).rowcount
+        if settled and not replayed and self.on_result is not None:
+            self.on_result(payload, status)
+
+    def start(self):
+        with self.lock:
+            if self.flusher is not None and self.flusher.is_alive() and self.flusher_pid == os.getpid():
+                return
+            self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+            self.flusher_pid = os.getpid()
+            self.flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            try:
+                claimed = self.flush()
+            except Exception:
+                # Keep the flusher alive, unsettled purchases are claimed again later
+                claimed = 0
+            if claimed < self.batch_size:
+                time.sleep(self.interval)
+
+    def stats(self):
+        rows = self.connection().execute("SELECT status, COUNT(*) FROM purchases GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
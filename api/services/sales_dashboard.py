@@ -0,0 +1,176 @@
+import threading
+from array import array
+from datetime import datetime, timedelta
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class VenueDashboard:
+    """Sales aggregates for one venue, per event and per day.
+
+    Built once from the venue's event list and then kept current from the app's
+    own create, delete, reserve and purchase actions. Daily totals are kept in
+    flat arrays indexed by days since the first event, so a season of events
+    costs a few bytes per day rather than a dict per day."""
+
+    def __init__(self, events=()):
+        self.lock = threading.Lock()
+        self.events = {}
+        self.start = None
+        self.day_total = array("l")
+        self.day_sold = array("l")
+        self.day_reserved = array("l")
+        self.day_revenue = array("d")
+        for event in events:
+            self._add(event)
+
+    def _day_index(self, day):
+        if self.start is None:
+            self.start = day
+        if day < self.start:
+            shift = (self.start - day).days
+            for series in (self.day_total, self.day_sold, self.day_reserved):
+                series[0:0] = array("l", [0] * shift)
+            self.day_revenue[0:0] = array("d", [0.0] * shift)
+            self.start = day
+        index = (day - self.start).days
+        missing = index + 1 - len(self.day_total)
+        if missing > 0:
+            for series in (self.day_total, self.day_sold, self.day_reserved):
+                series.extend([0] * missing)
+            self.day_revenue.extend([0.0] * missing)
+        return index
+
+    def _add(self, event):
+        if event.get("status") == "Cancelled" or not event.get("date_time"):
+            return
+        day = datetime.fromisoformat(event["date_time"]).date()
+        price = to_float(event.get("price"))
+        sold = to_int(event.get("sold_tickets"))
+        entry = {
+            "event_id": event["event_id"],
+            "event_name": event.get("event_name", ""),
+            "date": day,
+            "total": to_int(event.get("total_tickets")),
+            "sold": sold,
+            "reserved": 0,
+            "price": price,
+            "revenue": sold * price,
+        }
+        self.events[entry["event_id"]] = entry
+        index = self._day_index(day)
+        self.day_total[index] += entry["total"]
+        self.day_sold[index] += entry["sold"]
+        self.day_revenue[index] += entry["revenue"]
+
+    def add_event(self, event):
+        with self.lock:
+            self._remove(event["event_id"])
+            self._add(event)
+
+    def update_event(self, event_id, date_time=None, price=None):
+        """Moves an event to another day and/or sets the price of the tickets sold from
+        now on, keeping its sales so far. Returns False for an event it doesn't have."""
+        with self.lock:
+            entry = self.events.get(event_id)
+            if entry is None:
+                return False
+            if price is not None:
+                entry["price"] = to_float(price)
+            day = datetime.fromisoformat(date_time).date() if date_time else entry["date"]
+            if day != entry["date"]:
+                index = self._day_index(entry["date"])
+                self.day_total[index] -= entry["total"]
+                self.day_sold[index] -= entry["sold"]
+                self.day_reserved[index] -= entry["reserved"]
+                self.day_revenue[index] -= entry["revenue"]
+                entry["date"] = day
+                index = self._day_index(day)
+                self.day_total[index] += entry["total"]
+                self.day_sold[index] += entry["sold"]
+                self.day_reserved[index] += entry["reserved"]
+                self.day_revenue[index] += entry["revenue"]
+            return True
+
+    def _remove(self, event_id):
+        entry = self.events.pop(event_id, None)
+        if entry is None:
+            return False
+        index = self._day_index(entry["date"])
+        self.day_total[index] -= entry["total"]
+        self.day_sold[index] -= entry["sold"]
+        self.day_reserved[index] -= entry["reserved"]
+        self.day_revenue[index] -= entry["revenue"]
+        return True
+
+    def remove_event(self, event_id):
+        with self.lock:
+            return self._remove(event_id)
+
+    def record_reservation(self, event_id, n_tickets):
+        with self.lock:
+            entry = self.events.get(event_id)
+            if entry is None:
+                return
+            entry["reserved"] += n_tickets
+            self.day_reserved[self._day_index(entry["date"])] += n_tickets
+
+    def record_purchase(self, event_id, n_tickets, price=None):
+        with self.lock:
+            entry = self.events.get(event_id)
+            if entry is None:
+                return
+            price = entry["price"] if price is None else price
+            reserved = min(entry["reserved"], n_tickets)
+            index = self._day_index(entry["date"])
+            entry["reserved"] -= reserved
+            entry["sold"] += n_tickets
+            entry["revenue"] += n_tickets * price
+            self.day_reserved[index] -= reserved
+            self.day_sold[index] += n_tickets
+            self.day_revenue[index] += n_tickets * price
+
+    def summary(self):
+        with self.lock:
+            events = sorted(
+                (dict(entry, sell_through=entry["sold"] / entry["total"] if entry["total"] else 0.0)
+                 for entry in self.events.values()),
+                key=lambda entry: entry["date"],
+            )
+            days = []
+            for i, total in enumerate(self.day_total):
+                if not total and not self.day_sold[i]:
+                    continue
+                days.append(
+                    {
+                        "date": self.start + timedelta(days=i),
+                        "total": total,
+                        "sold": self.day_sold[i],
+                        "reserved": self.day_reserved[i],
+                        "revenue": self.day_revenue[i],
+                        "sell_through": self.day_sold[i] / total if total else 0.0,
+                    }
+                )
+            total = sum(self.day_total)
+            sold = sum(self.day_sold)
+            return {
+                "events": events,
+                "days": days,
+                "total": total,
+                "sold": sold,
+                "reserved": sum(self.day_reserved),
+                "revenue": sum(self.day_revenue),
+                "sell_through": sold / total if total else 0.0,
+            }
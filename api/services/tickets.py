@@ -0,0 +1,175 @@
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import segno  # type: ignore
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+QR_SIZE = 300
+
+
+def ticket_key(ticket, payload):
+    """Content address of a rendered ticket: changes whenever anything printed on it does"""
+    content = json.dumps({"ticket": ticket, "payload": payload}, sort_keys=True, default=str)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def document_key(tickets):
+    """Content address of the combined PDF for a list of (ticket, payload)"""
+    keys = "".join(ticket_key(ticket, payload) for ticket, payload in tickets)
+    return hashlib.sha256(keys.encode()).hexdigest()
+
+
+def render_qr_svg(payload):
+    buffer = io.BytesIO()
+    segno.make(payload, error="m").save(buffer, kind="svg", scale=4, border=4, xmldecl=False)
+    return buffer.getvalue()
+
+
+def pdf_text(text):
+    # Built-in fonts only cover Latin-1, anything else prints as ?
+    text = str(text).encode("latin-1", errors="replace").decode("latin-1")
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def render_pdf_page(ticket, payload):
+    """PDF content stream for one ticket: its details and the QR code as filled squares"""
+    lines = [
+        (24, ticket.get("event_name", "Event")),
+        (14, f"Date: {ticket.get('date_time', 'TBC')}"),
+        (14, f"Ticket: {ticket.get('ticket_id')}"),
+        (14, f"Price: {ticket.get('price', '')}"),
+    ]
+    ops = ["BT"]
+    y = PAGE_HEIGHT - 80
+    for size, text in lines:
+        ops.append(f"/F1 {size} Tf 1 0 0 1 60 {y} Tm ({pdf_text(text)}) Tj")
+        y -= size + 16
+    ops.append("ET")
+    rows = [list(row) for row in segno.make(payload, error="m").matrix_iter(border=4)]
+    module = QR_SIZE / len(rows)
+    left, top = (PAGE_WIDTH - QR_SIZE) / 2, y - 40
+    for r, row in enumerate(rows):
+        c = 0
+        while c < len(row):
+            if not row[c]:
+                c += 1
+                continue
+            start = c
+            while c < len(row) and row[c]:
+                c += 1
+            # One rectangle per horizontal run of dark modules
+            ops.append(
+                f"{left + start * module:.2f} {top - (r + 1) * module:.2f} {(c - start) * module:.2f} {module:.2f} re"
+            )
+    ops.append("f")
+    return "\n".join(ops).encode("latin-1")
+
+
+def build_pdf(pages):
+    """Assembles page content streams into a PDF document"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    kids = []
+    for content in pages:
+        page_number = len(objects) + 1
+        kids.append(f"{page_number} 0 R")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_number + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(b"%d 0 obj\n" % number + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1))
+    for offset in offsets:
+        out.write(b"%010d 00000 n \n" % offset)
+    out.write(b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref))
+    return out.getvalue()
+
+
+class TicketRenderer:
+    """Renders ticket QR codes and PDF pages on a process pool, caching each result on
+    disk under its ticket_key so every worker on the host serves repeats from the cache.
+    Tickets that aren't cached yet are rendered in parallel, at most max_workers at a time."""
+
+    def __init__(self, directory, max_workers=2):
+        self.directory = directory
+        self.max_workers = max_workers
+        self.executor = None
+        self.executor_pid = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def pool(self):
+        # Created on first use in each process, a pool can't be shared across a fork. Its
+        # processes come from a forkserver: forking a threaded worker can copy a lock
+        # another thread holds (logging, sqlite) into the child, which then deadlocks
+        with self.lock:
+            if self.executor is None or self.executor_pid != os.getpid():
+                method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context(method)
+                )
+                self.executor_pid = os.getpid()
+            return self.executor
+
+    def path(self, key, suffix):
+        return os.path.join(self.directory, f"{key}.{suffix}")
+
+    def read(self, key, suffix):
+        try:
+            with open(self.path(key, suffix), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write(self, key, suffix, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(key, suffix))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def render_all(self, suffix, render, jobs):
+        """jobs is a list of (key, args). Returns the rendered bytes for each, in order"""
+        results = [self.read(key, suffix) for key, _ in jobs]
+        missing = [i for i, data in enumerate(results) if data is None]
+        if missing:
+            pool = self.pool()
+            futures = {i: pool.submit(render, *jobs[i][1]) for i in missing}
+            for i, future in futures.items():
+                results[i] = future.result()
+                self.write(jobs[i][0], suffix, results[i])
+        return results
+
+    def qr_svg(self, ticket, payload):
+        return self.render_all("svg", render_qr_svg, [(ticket_key(ticket, payload), (payload,))])[0]
+
+    def pdf(self, tickets):
+        """tickets is a list of (ticket, payload). Returns one PDF with a page per ticket"""
+        combined_key = document_key(tickets)
+        document = self.read(combined_key, "pdf")
+        if document is None:
+            jobs = [(ticket_key(ticket, payload), (ticket, payload)) for ticket, payload in tickets]
+            document = build_pdf(self.render_all("page", render_pdf_page, jobs))
+            self.write(combined_key, "pdf", document)
+        return document
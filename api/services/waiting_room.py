@@ -0,0 +1,160 @@
+import sqlite3
+import threading
+import time
+
+from ..utils.cache import create_private_file, thread_connection
+
+ADMITTED = "admitted"
+QUEUED = "queued"
+REJECTED = "rejected"
+
+
+class WaitingRoom:
+    """Admission control for ticket checkouts.
+
+    Each event admits at most `capacity` buyers at a time. An admitted buyer keeps
+    their slot for `admission_ttl` seconds or until released after purchasing,
+    everyone else waits in a FIFO queue and is admitted as slots free up. Queued
+    buyers that stop polling for `queue_ttl` seconds drop out of the queue. Once
+    `max_queued` buyers are waiting across all events new arrivals are rejected.
+
+    State lives in a SQLite file shared by every worker on the host, so a buyer
+    admitted by one worker is admitted on all of them and capacity is per host.
+    An event has no rows once nobody is admitted or waiting for it."""
+
+    KEEP_WAIT_TIMES = 1000
+
+    def __init__(self, path, capacity=50, admission_ttl=600, queue_ttl=60, max_queued=5000):
+        self.path = path
+        self.capacity = capacity
+        self.admission_ttl = admission_ttl
+        self.queue_ttl = queue_ttl
+        self.max_queued = max_queued
+        self.local = threading.local()
+        create_private_file(path)
+        conn = self.connection()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS admitted (event_id TEXT NOT NULL, buyer_id TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, PRIMARY KEY (event_id, buyer_id))"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS queue (seq INTEGER PRIMARY KEY AUTOINCREMENT, event_id TEXT NOT NULL, "
+            "buyer_id TEXT NOT NULL, enqueued_at REAL NOT NULL, last_seen REAL NOT NULL, UNIQUE (event_id, buyer_id))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS queue_last_seen ON queue (last_seen)")
+        conn.execute("CREATE TABLE IF NOT EXISTS wait_times (id INTEGER PRIMARY KEY AUTOINCREMENT, seconds REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+
+    def connection(self):
+        return thread_connection(self.local, self.path)
+
+    def transaction(self, fn, *args):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn, *args)
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def enter(self, event_id, buyer_id):
+        """Returns (status, position) for the buyer, joining the queue if needed"""
+        return self.transaction(self._enter, event_id, buyer_id, time.time())
+
+    def _enter(self, conn, event_id, buyer_id, now):
+        self._promote(conn, event_id, now)
+        if self._is_admitted(conn, event_id, buyer_id):
+            return ADMITTED, 0
+        row = conn.execute(
+            "SELECT seq FROM queue WHERE event_id = ? AND buyer_id = ?", (event_id, buyer_id)
+        ).fetchone()
+        if row is not None:
+            conn.execute("UPDATE queue SET last_seen = ? WHERE seq = ?", (now, row[0]))
+            return QUEUED, self._position(conn, event_id, row[0])
+        n_queued = conn.execute("SELECT COUNT(*) FROM queue WHERE event_id = ?", (event_id,)).fetchone()[0]
+        if not n_queued and self._n_admitted(conn, event_id) < self.capacity:
+            self._admit(conn, event_id, buyer_id, now, 0.0)
+            return ADMITTED, 0
+        if conn.execute("SELECT COUNT(*) FROM queue").fetchone()[0] >= self.max_queued:
+            conn.execute(
+                "INSERT INTO counters (name, value) VALUES ('rejected_total', 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1"
+            )
+            return REJECTED, None
+        conn.execute(
+            "INSERT INTO queue (event_id, buyer_id, enqueued_at, last_seen) VALUES (?, ?, ?, ?)",
+            (event_id, buyer_id, now, now),
+        )
+        return QUEUED, n_queued + 1
+
+    def is_admitted(self, event_id, buyer_id):
+        return self.transaction(self._check_admitted, event_id, buyer_id, time.time())
+
+    def _check_admitted(self, conn, event_id, buyer_id, now):
+        self._promote(conn, event_id, now)
+        return self._is_admitted(conn, event_id, buyer_id)
+
+    def release(self, event_id, buyer_id):
+        self.transaction(self._release, event_id, buyer_id, time.time())
+
+    def _release(self, conn, event_id, buyer_id, now):
+        conn.execute("DELETE FROM admitted WHERE event_id = ? AND buyer_id = ?", (event_id, buyer_id))
+        self._promote(conn, event_id, now)
+
+    def _is_admitted(self, conn, event_id, buyer_id):
+        return (
+            conn.execute(
+                "SELECT 1 FROM admitted WHERE event_id = ? AND buyer_id = ?", (event_id, buyer_id)
+            ).fetchone()
+            is not None
+        )
+
+    def _n_admitted(self, conn, event_id):
+        return conn.execute("SELECT COUNT(*) FROM admitted WHERE event_id = ?", (event_id,)).fetchone()[0]
+
+    def _position(self, conn, event_id, seq):
+        return conn.execute(
+            "SELECT COUNT(*) FROM queue WHERE event_id = ? AND seq <= ?", (event_id, seq)
+        ).fetchone()[0]
+
+    def _admit(self, conn, event_id, buyer_id, now, waited):
+        conn.execute(
+            "INSERT OR REPLACE INTO admitted (event_id, buyer_id, expires_at) VALUES (?, ?, ?)",
+            (event_id, buyer_id, now + self.admission_ttl),
+        )
+        cursor = conn.execute("INSERT INTO wait_times (seconds) VALUES (?)", (waited,))
+        conn.execute("DELETE FROM wait_times WHERE id <= ?", (cursor.lastrowid - self.KEEP_WAIT_TIMES,))
+
+    def _promote(self, conn, event_id, now):
+        # Expired slots and buyers that stopped polling are dropped for every event, so
+        # rooms nobody comes back to don't linger or count towards max_queued
+        conn.execute("DELETE FROM admitted WHERE expires_at <= ?", (now,))
+        conn.execute("DELETE FROM queue WHERE last_seen < ?", (now - self.queue_ttl,))
+        free = self.capacity - self._n_admitted(conn, event_id)
+        if free <= 0:
+            return
+        rows = conn.execute(
+            "SELECT seq, buyer_id, enqueued_at FROM queue WHERE event_id = ? ORDER BY seq LIMIT ?", (event_id, free)
+        ).fetchall()
+        for seq, buyer_id, enqueued_at in rows:
+            conn.execute("DELETE FROM queue WHERE seq = ?", (seq,))
+            self._admit(conn, event_id, buyer_id, now, now - enqueued_at)
+
+    def stats(self):
+        conn = self.connection()
+        events = {}
+        for event_id, n in conn.execute("SELECT event_id, COUNT(*) FROM admitted GROUP BY event_id"):
+            events[event_id] = {"admitted": n, "queued": 0}
+        for event_id, n in conn.execute("SELECT event_id, COUNT(*) FROM queue GROUP BY event_id"):
+            events.setdefault(event_id, {"admitted": 0, "queued": 0})["queued"] = n
+        waits = sorted(seconds for (seconds,) in conn.execute("SELECT seconds FROM wait_times"))
+        rejected = conn.execute("SELECT value FROM counters WHERE name = 'rejected_total'").fetchone()
+        return {
+            "events": events,
+            "queued_total": sum(room["queued"] for room in events.values()),
+            "rejected_total": rejected[0] if rejected else 0,
+            "wait_seconds_mean": sum(waits) / len(waits) if waits else 0.0,
+            "wait_seconds_p95": waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+        }
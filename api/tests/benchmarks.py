@@ -0,0 +1,239 @@
+"""Micro-benchmarks for the building blocks every request goes through.
+
+Run from the repository root. The first run with --save records a baseline; later runs
+compare against it and exit with status 1 when a benchmark's best time got slower by more
+than the threshold (the best of several runs is far less noisy than the mean or median):
+
+    python -m api.tests.benchmarks --save
+    python -m api.tests.benchmarks --threshold 0.25 --threshold-for render_events_10k=0.5
+
+Baselines are machine specific, record and compare them on the same host.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict
+
+# Keep the benchmarks off the shared SQLite cache and the real gateway
+os.environ.setdefault("CACHE_BACKEND", "memory")
+
+from api import app as app_module  # noqa: E402
+from api import auth  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "benchmark_baseline.json")
+BENCHMARKS: Dict[str, Callable[[], Callable[[], object]]] = {}
+
+
+def benchmark(name):
+    """Registers a setup function returning the zero-argument callable to time"""
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+def sample_events(n):
+    return [
+        {
+            "event_id": str(i),
+            "event_name": f"Event {i}",
+            "venue_id": f"venue-{i % 50}",
+            "artist_ids": [f"artist-{i % 200}"],
+            "date_time": f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}T{i % 24:02d}:30:00",
+            "total_tickets": 500,
+            "sold_tickets": i % 500,
+            "price": f"{i % 80 + 5}.00",
+            "status": "Active",
+        }
+        for i in range(n)
+    ]
+
+
+class FakeCredentials:
+    def __init__(self):
+        self.token = "x" * 900
+        self.valid = True
+
+    def refresh(self, request):
+        self.valid = True
+
+
+@benchmark("get_token_in_process")
+def bench_get_token_in_process():
+    auth._credentials = FakeCredentials()
+    return auth.get_token
+
+
+@benchmark("get_token_shared_cache")
+def bench_get_token_shared_cache():
+    # Another worker refreshed the token: this one reads it from the shared cache
+    auth._credentials = None
+    auth.shared_cache.set("gateway_token", "x" * 900, 3600)
+    return auth.get_token
+
+
+@benchmark("get_token_refresh")
+def bench_get_token_refresh():
+    # Expired everywhere: the refresh itself is stubbed, this times the locking and caching around it
+    credentials = FakeCredentials()
+    auth.load_credentials = lambda: credentials
+
+    def run():
+        auth._credentials = None
+        auth.shared_cache.delete("gateway_token")
+        auth.get_token()
+
+    return run
+
+
+class StubGateway(BaseHTTPRequestHandler):
+    body = json.dumps({"message": {"data": sample_events(50)}}).encode()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, *args):
+        pass
+
+
+@benchmark("make_jwt_request_local_stub")
+def bench_make_jwt_request():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGateway)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    os.environ["GATEWAY_HOST"] = f"http://127.0.0.1:{server.server_address[1]}"
+    req = {"function": "get", "object_type": "event", "identifier": "Bristol"}
+    return lambda: auth.make_jwt_request("token", "/get_events_in_city", req)
+
+
+@benchmark("annotate_event_dates_1k")
+def bench_annotate_event_dates():
+    events = sample_events(1000)
+    return lambda: app_module.annotate_event_dates(events)
+
+
+@benchmark("sanitize_buy_form")
+def bench_sanitize_buy_form():
+    # The hidden inputs events.html posts to buy_event, one per event field
+    event = app_module.annotate_event_dates(sample_events(1))[0]
+    form = {f"event_{key}": str(value) for key, value in event.items()}
+    form["event_event_name"] = "<b>Summer</b> Jazz & Blues <script>alert(1)</script>"
+    return lambda: {key: app_module.sanitize(value) for key, value in form.items()}
+
+
+@benchmark("session_serialize_200_events")
+def bench_session_serialize():
+    serializer = app_module.app.session_interface.get_signing_serializer(app_module.app)
+    session = {"user_id": "venue", "user_type": "venue", "user_events": sample_events(200)}
+    return lambda: serializer.loads(serializer.dumps(session))
+
+
+def bench_render_events(n):
+    app = app_module.app
+    events = app_module.annotate_event_dates(sample_events(n))
+
+    def run():
+        with app.test_request_context("/events"):
+            app_module.session["user_type"] = "attendee"
+            app_module.session["city"] = "Bristol"
+            app_module.render_template("events.html", events=events, stale=False)
+
+    return run
+
+
+for n_events, label in [(20, "20"), (1000, "1k"), (10000, "10k")]:
+    benchmark(f"render_events_{label}")(lambda n=n_events: bench_render_events(n))
+
+
+def time_benchmark(fn, repeats=5, min_time=0.1):
+    """Median and best seconds per call over `repeats` runs of at least min_time each"""
+    fn()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    timings = [elapsed / number]
+    for _ in range(repeats - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        timings.append((time.perf_counter() - start) / number)
+    return {"median_us": statistics.median(timings) * 1e6, "min_us": min(timings) * 1e6, "calls": number}
+
+
+def compare(results, baseline, threshold, overrides=None):
+    """Returns (name, ratio, regressed) for every benchmark present in both runs"""
+    overrides = overrides or {}
+    rows = []
+    for name, result in results.items():
+        previous = baseline.get("benchmarks", {}).get(name)
+        if not previous:
+            continue
+        ratio = result["min_us"] / previous["min_us"]
+        rows.append((name, ratio, ratio - 1 > overrides.get(name, threshold)))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-k", "--filter", default="", help="only run benchmarks whose name contains this")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed slowdown, 0.25 = 25%%")
+    parser.add_argument("--threshold-for", action="append", default=[], metavar="NAME=FRACTION")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args(argv)
+    overrides = {name: float(value) for name, value in (item.split("=", 1) for item in args.threshold_for)}
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        results[name] = time_benchmark(setup(), repeats=args.repeats)
+        print(f"{name:<32} median {results[name]['median_us']:12.1f}us  min {results[name]['min_us']:12.1f}us")
+
+    status = 0
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"\nCompared with {args.baseline} ({baseline.get('python')}, {baseline.get('machine')})")
+        for name, ratio, regressed in compare(results, baseline, args.threshold, overrides):
+            print(f"{name:<32} {ratio - 1:+8.1%}{'  REGRESSION' if regressed else ''}")
+            status = 1 if regressed else status
+    if args.save:
+        # Saving a filtered run only replaces the benchmarks that ran
+        saved = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                saved = json.load(f).get("benchmarks", {})
+        saved.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(
+                {"python": platform.python_version(), "machine": platform.node(), "benchmarks": saved},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        print(f"\nBaseline written to {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
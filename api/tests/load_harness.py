@@ -0,0 +1,61 @@
+"""Simple load harness for comparing serving configurations.
+
+Start the app, e.g. `gunicorn -c gunicorn.conf.py api.app:app`, then run:
+
+    python api/tests/load_harness.py --url http://localhost:5000 --paths / /readyz -c 32 -n 2000
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run(url, paths, concurrency, n_requests):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    def hit(i):
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        try:
+            status = session.get(f"{url}{path}", timeout=30, allow_redirects=False).status_code
+        except requests.RequestException:
+            status = 0
+        return path, status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(hit, range(n_requests)))
+    elapsed = time.perf_counter() - start
+
+    print(f"{n_requests} requests, concurrency {concurrency}, {elapsed:.2f}s, {n_requests / elapsed:.1f} req/s")
+    for path in paths:
+        latencies = sorted(r[2] * 1000 for r in results if r[0] == path)
+        errors = sum(1 for r in results if r[0] == path and (r[1] == 0 or r[1] >= 500))
+        print(
+            f"  {path:<20} mean {statistics.mean(latencies):7.1f}ms  p50 {percentile(latencies, 50):7.1f}ms"
+            f"  p95 {percentile(latencies, 95):7.1f}ms  p99 {percentile(latencies, 99):7.1f}ms  errors {errors}"
+        )
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default=os.environ.get("STAGING_URL", "http://localhost:5000"))
+    parser.add_argument("--paths", nargs="+", default=["/", "/healthz", "/readyz"])
+    parser.add_argument("-c", "--concurrency", type=int, default=16)
+    parser.add_argument("-n", "--requests", type=int, default=1000)
+    args = parser.parse_args()
+    run(args.url.rstrip("/"), args.paths, args.concurrency, args.requests)
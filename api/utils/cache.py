@@ -0,0 +1,272 @@
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LockTimeout(Exception):
+    """Another caller held the lock on a key for longer than lock_timeout"""
+
+
+def create_private_file(path):
+    """Creates path readable by its owner only, unless it already exists. SQLite gives
+    the -wal and -shm files it adds next to a database the same permissions."""
+    os.close(os.open(path, os.O_CREAT | os.O_RDWR, 0o600))
+
+
+def thread_connection(local, path, *pragmas):
+    """The calling thread's connection to the SQLite file at path in WAL mode, kept on
+    the threading.local `local`. One connection per thread and process, connections
+    can't cross a fork"""
+    conn = getattr(local, "conn", None)
+    if conn is None or local.pid != os.getpid():
+        conn = sqlite3.connect(path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        for pragma in pragmas:
+            conn.execute(pragma)
+        local.conn = conn
+        local.pid = os.getpid()
+    return conn
+
+
+class CacheBackend:
+    """Key/value cache for gateway reads. Values must be JSON serialisable."""
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def expires_in(self, key):
+        """Seconds until key expires, None when it isn't cached"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def acquire(self, key, timeout):
+        raise NotImplementedError
+
+    def release(self, key):
+        raise NotImplementedError
+
+    def renew(self, key, timeout):
+        """Extends a held lock to expire timeout seconds from now"""
+        raise NotImplementedError
+
+    def get_or_compute(self, key, compute, ttl, lock_timeout=10.0, exclusive=False):
+        """Returns the cached value or computes, stores and returns it. Only one caller
+        computes a missing key at a time, the others wait for its result. A caller that
+        waited lock_timeout computes anyway, unless the computation is exclusive: then
+        the lock is renewed while compute runs, so it only lapses if its holder dies, and
+        waiters never take it over but raise LockTimeout."""
+        value = self.get(key, MISSING)
+        if value is not MISSING:
+            return value
+        deadline = time.monotonic() + lock_timeout
+        may_acquire = True
+        while True:
+            if may_acquire and self.acquire(key, lock_timeout):
+                try:
+                    value = self.get(key, MISSING)
+                    if value is MISSING:
+                        value = self.compute_renewing(key, compute, lock_timeout) if exclusive else compute()
+                        self.set(key, value, ttl)
+                    return value
+                finally:
+                    self.release(key)
+            # Taking over a lock that lapsed mid-compute would run an exclusive one twice
+            may_acquire = not exclusive
+            time.sleep(0.02)
+            value = self.get(key, MISSING)
+            if value is not MISSING:
+                return value
+            if time.monotonic() > deadline:
+                if exclusive:
+                    raise LockTimeout(key)
+                # Whoever holds the lock is stuck, don't wait on them any longer
+                return compute()
+
+    def compute_renewing(self, key, compute, lock_timeout):
+        done = threading.Event()
+
+        def renew():
+            while not done.wait(lock_timeout / 3):
+                self.renew(key, lock_timeout)
+
+        threading.Thread(target=renew, daemon=True).start()
+        try:
+            return compute()
+        finally:
+            done.set()
+
+
+class MemoryCache(CacheBackend):
+    """Per-process cache, evicts the least recently used entry past max_entries.
+    Values are stored serialised like the shared backend, so callers can't mutate them."""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.locks = {}
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return default
+            self.entries.move_to_end(key)
+        return json.loads(value)
+
+    def expires_in(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[1] - time.time()
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (json.dumps(value), time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.locks.clear()
+
+    def acquire(self, key, timeout):
+        now = time.monotonic()
+        with self.lock:
+            if self.locks.get(key, 0) > now:
+                return False
+            self.locks[key] = now + timeout
+            return True
+
+    def release(self, key):
+        with self.lock:
+            self.locks.pop(key, None)
+
+    def renew(self, key, timeout):
+        with self.lock:
+            if key in self.locks:
+                self.locks[key] = time.monotonic() + timeout
+
+
+class SQLiteCache(CacheBackend):
+    """Cache shared by every worker process on the host through one SQLite file in
+    WAL mode, so readers never block each other or the writer. Entries expire
+    after their TTL and the ones closest to expiring are evicted past max_entries."""
+
+    EVICT_EVERY = 100
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.writes = 0
+        # Holds the gateway token among other things
+        create_private_file(path)
+        with self.connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+            conn.execute("CREATE TABLE IF NOT EXISTS locks (key TEXT PRIMARY KEY, expires_at REAL NOT NULL)")
+
+    def connection(self):
+        return thread_connection(self.local, self.path, "PRAGMA synchronous=NORMAL")
+
+    def get(self, key, default=None):
+        row = self.connection().execute(
+            "SELECT value FROM cache WHERE key = ? AND expires_at > ?", (key, time.time())
+        ).fetchone()
+        if row is None:
+            return default
+        return json.loads(row[0])
+
+    def expires_in(self, key):
+        now = time.time()
+        row = self.connection().execute(
+            "SELECT expires_at FROM cache WHERE key = ? AND expires_at > ?", (key, now)
+        ).fetchone()
+        return None if row is None else row[0] - now
+
+    def set(self, key, value, ttl):
+        conn = self.connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value), time.time() + ttl),
+        )
+        self.writes += 1
+        if self.writes % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def evict(self):
+        conn = self.connection()
+        conn.execute("DELETE FROM cache WHERE expires_at <= ?", (time.time(),))
+        excess = conn.execute("SELECT COUNT(*) FROM cache").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY expires_at LIMIT ?)", (excess,)
+            )
+
+    def delete(self, key):
+        self.connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def clear(self):
+        conn = self.connection()
+        conn.execute("DELETE FROM cache")
+        conn.execute("DELETE FROM locks")
+
+    def acquire(self, key, timeout):
+        now = time.time()
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM locks WHERE key = ? AND expires_at <= ?", (key, now))
+            acquired = conn.execute(
+                "INSERT OR IGNORE INTO locks (key, expires_at) VALUES (?, ?)", (key, now + timeout)
+            ).rowcount
+            conn.execute("COMMIT")
+        except sqlite3.Error:
+            conn.execute("ROLLBACK")
+            raise
+        return acquired == 1
+
+    def release(self, key):
+        self.connection().execute("DELETE FROM locks WHERE key = ?", (key,))
+
+    def renew(self, key, timeout):
+        self.connection().execute("UPDATE locks SET expires_at = ? WHERE key = ?", (time.time() + timeout, key))
+
+
+def make_cache_backend():
+    max_entries = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+    if os.environ.get("CACHE_BACKEND", "sqlite") == "memory":
+        return MemoryCache(max_entries=max_entries)
+    path = os.environ.get("CACHE_PATH", os.path.join(tempfile.gettempdir(), "jumpstart-cache.sqlite3"))
+    return SQLiteCache(path, max_entries=max_entries)
+
+
+shared_cache = make_cache_backend()
@@ -0,0 +1,60 @@
+import threading
+import time
+from collections import deque
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing.
+
+    The last `window` calls are tracked, a call counts as failed when it errors
+    or takes longer than `slow_call_seconds`. Once at least `min_calls` are
+    recorded and the failure rate reaches `error_rate`, the circuit opens and
+    calls are rejected for `reset_timeout` seconds. After that a single probe
+    call is let through (half open): success closes the circuit, failure opens
+    it again."""
+
+    def __init__(self, error_rate=0.5, min_calls=10, window=20, slow_call_seconds=5.0, reset_timeout=30.0):
+        self.error_rate = error_rate
+        self.min_calls = min_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_timeout = reset_timeout
+        self.outcomes = deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def record(self, ok, duration=0.0):
+        failed = not ok or duration > self.slow_call_seconds
+        with self.lock:
+            if self.state == HALF_OPEN:
+                self.probing = False
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self.outcomes.clear()
+                return
+            self.outcomes.append(failed)
+            if len(self.outcomes) >= self.min_calls and sum(self.outcomes) / len(self.outcomes) >= self.error_rate:
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self.outcomes.clear()
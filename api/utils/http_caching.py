@@ -0,0 +1,109 @@
+import gzip
+import hashlib
+import os
+from functools import lru_cache, wraps
+
+from flask import current_app, make_response, request
+
+try:
+    import brotli  # type: ignore
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "application/json",
+    "application/javascript",
+}
+STATIC_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def register_http_caching(app):
+    """Adds response compression, static fingerprinting and cache headers to the app"""
+    app.config.setdefault("COMPRESS_MIN_SIZE", int(os.environ.get("COMPRESS_MIN_SIZE", "1024")))
+    app.config.setdefault("COMPRESS_LEVEL", int(os.environ.get("COMPRESS_LEVEL", "6")))
+    app.url_defaults(fingerprint_static_url)
+    app.after_request(cache_static_response)
+    app.after_request(compress_response)
+
+
+@lru_cache(maxsize=None)
+def static_file_hash(static_folder, filename):
+    try:
+        with open(os.path.join(static_folder, filename), "rb") as f:
+            return hashlib.md5(f.read()).hexdigest()[:12]
+    except OSError:
+        return None
+
+
+def fingerprint_static_url(endpoint, values):
+    # url_for("static", ...) gets a content hash appended, so a changed file
+    # gets a new URL and old copies can be cached forever
+    if endpoint != "static" or "filename" not in values or "v" in values:
+        return
+    file_hash = static_file_hash(current_app.static_folder, values["filename"])
+    if file_hash:
+        values["v"] = file_hash
+
+
+def cache_static_response(response):
+    if request.endpoint == "static" and "v" in request.args and response.status_code == 200:
+        response.cache_control.public = True
+        response.cache_control.max_age = STATIC_MAX_AGE
+        response.cache_control.immutable = True
+    return response
+
+
+def choose_encoding(accept_encoding):
+    if brotli is not None and "br" in accept_encoding:
+        return "br"
+    if "gzip" in accept_encoding:
+        return "gzip"
+    return None
+
+
+def compress_response(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", "").lower())
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < current_app.config["COMPRESS_MIN_SIZE"]:
+        return response
+
+    level = current_app.config["COMPRESS_LEVEL"]
+    if encoding == "br":
+        compressed = brotli.compress(data, quality=min(level, 11))
+    else:
+        compressed = gzip.compress(data, compresslevel=level)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def weak_etag(f):
+    """Tags a page with a weak ETag of its body and answers 304 when the client copy is current.
+    Only use for pages whose content is the same for every visitor with the same session"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        response = make_response(f(*args, **kwargs))
+        if request.method != "GET" or response.status_code != 200:
+            return response
+        response.set_etag(hashlib.md5(response.get_data()).hexdigest(), weak=True)
+        response.cache_control.no_cache = True
+        response.cache_control.private = True
+        response.vary.add("Cookie")
+        return response.make_conditional(request)
+
+    return decorated_function
@@ -0,0 +1,117 @@
+import random
+import threading
+import tracemalloc
+from collections import defaultdict, deque
+
+from flask import current_app, g, request, session
+
+try:
+    import resource
+except ImportError:
+    resource = None  # type: ignore
+
+SESSION_LOG = "log"
+SESSION_REJECT = "reject"
+
+
+def percentiles(values):
+    if not values:
+        return {"count": 0, "p50": 0, "p95": 0, "p99": 0, "max": 0}
+    values = sorted(values)
+    last = len(values) - 1
+    return {
+        "count": len(values),
+        "p50": values[int(0.50 * last)],
+        "p95": values[int(0.95 * last)],
+        "p99": values[int(0.99 * last)],
+        "max": values[last],
+    }
+
+
+class MemoryAccounting:
+    """Records peak Python allocation per route and the serialised session size per response.
+
+    Peak allocation comes from tracemalloc, which slows down every allocation while it
+    runs, so only `sample_rate` of requests are traced and never more than one at a
+    time. The peak is process-wide, so with threaded workers it includes whatever
+    other threads allocated during the same request. Sessions larger than
+    `session_budget` bytes are logged, or with session_action="reject" the request
+    fails and the oversized session isn't saved."""
+
+    def __init__(self, sample_rate=0.05, session_budget=3800, session_action=SESSION_LOG, window=500):
+        self.sample_rate = sample_rate
+        self.session_budget = session_budget
+        self.session_action = session_action
+        self.peak_bytes = defaultdict(lambda: deque(maxlen=window))
+        self.session_bytes = defaultdict(lambda: deque(maxlen=window))
+        self.oversized_sessions = 0
+        self.tracing = threading.Lock()
+
+    def start_request(self):
+        if random.random() >= self.sample_rate or tracemalloc.is_tracing():
+            return
+        if not self.tracing.acquire(blocking=False):
+            return
+        g.memory_traced = True
+        tracemalloc.start()
+
+    def finish_request(self, response):
+        endpoint = request.endpoint or "unknown"
+        if g.pop("memory_traced", False):
+            _, peak = tracemalloc.get_traced_memory()
+            self.stop_tracing()
+            self.peak_bytes[endpoint].append(peak)
+        if session.modified:
+            return self.check_session(endpoint, response)
+        return response
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+        self.tracing.release()
+
+    def cleanup_request(self, exc=None):
+        if g.pop("memory_traced", False):
+            self.stop_tracing()
+
+    def check_session(self, endpoint, response):
+        app = current_app._get_current_object()  # type: ignore
+        serializer = app.session_interface.get_signing_serializer(app)
+        if serializer is None:
+            return response
+        size = len(serializer.dumps(dict(session)))
+        self.session_bytes[endpoint].append(size)
+        if size <= self.session_budget:
+            return response
+        self.oversized_sessions += 1
+        app.logger.warning(
+            f"Session for {endpoint} is {size} bytes, over the {self.session_budget} byte budget "
+            f"(largest keys: {', '.join(largest_session_keys())})"
+        )
+        if self.session_action != SESSION_REJECT:
+            return response
+        # Keep the previous cookie rather than sending one browsers will drop
+        session.modified = False
+        return app.make_response(("Session data too large", 500))
+
+    def stats(self):
+        stats = {
+            "peak_alloc_bytes": {endpoint: percentiles(values) for endpoint, values in self.peak_bytes.items()},
+            "session_bytes": {endpoint: percentiles(values) for endpoint, values in self.session_bytes.items()},
+            "oversized_sessions": self.oversized_sessions,
+            "session_budget_bytes": self.session_budget,
+        }
+        if resource is not None:
+            # ru_maxrss is in kilobytes on Linux
+            stats["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return stats
+
+
+def largest_session_keys(n=3):
+    sizes = {key: len(repr(value)) for key, value in session.items()}
+    return sorted(sizes, key=sizes.__getitem__, reverse=True)[:n]
+
+
+def register_memory_accounting(app, accounting):
+    app.before_request(accounting.start_request)
+    app.after_request(accounting.finish_request)
+    app.teardown_request(accounting.cleanup_request)
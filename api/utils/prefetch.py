@@ -0,0 +1,84 @@
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import g
+
+
+class Prefetcher:
+    """Runs speculative cache warming on a small background pool.
+
+    Work is dropped rather than queued when it would compete with real traffic:
+    when the same key is already pending, more than max_pending tasks are waiting,
+    the per-minute budget is spent, or more than max_foreground requests are in
+    flight in this worker."""
+
+    def __init__(self, max_workers=2, max_pending=20, per_minute=60, max_foreground=8):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prefetch")
+        self.max_pending = max_pending
+        self.per_minute = per_minute
+        self.max_foreground = max_foreground
+        self.pending = set()
+        self.foreground = 0
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def submit(self, key, fn, *args):
+        """Schedules fn(*args) unless a budget says no. Returns whether it was scheduled"""
+        with self.lock:
+            reason = self._refusal(key)
+            if reason:
+                self.counts[f"skipped_{reason}"] += 1
+                return False
+            self.pending.add(key)
+            self.window_count += 1
+            self.counts["submitted"] += 1
+        self.executor.submit(self._run, key, fn, *args)
+        return True
+
+    def _refusal(self, key):
+        now = time.monotonic()
+        if now - self.window_start >= 60:
+            self.window_start, self.window_count = now, 0
+        if key in self.pending:
+            return "duplicate"
+        if len(self.pending) >= self.max_pending:
+            return "queue_full"
+        if self.window_count >= self.per_minute:
+            return "budget"
+        if self.foreground > self.max_foreground:
+            return "busy"
+        return None
+
+    def _run(self, key, fn, *args):
+        try:
+            fn(*args)
+            outcome = "completed"
+        except Exception:
+            # Speculative work, the foreground request will fetch it if it's needed
+            outcome = "failed"
+        with self.lock:
+            self.pending.discard(key)
+            self.counts[outcome] += 1
+
+    def start_request(self):
+        g.prefetch_counted = True
+        with self.lock:
+            self.foreground += 1
+
+    def finish_request(self, exc=None):
+        if g.pop("prefetch_counted", False):
+            with self.lock:
+                self.foreground -= 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, pending=len(self.pending), foreground=self.foreground)
+
+
+def register_prefetching(app, prefetcher):
+    app.before_request(prefetcher.start_request)
+    app.teardown_request(prefetcher.finish_request)
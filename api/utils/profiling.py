@@ -0,0 +1,184 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+from flask import before_render_template, g, request, template_rendered
+
+current_phases: contextvars.ContextVar = contextvars.ContextVar("current_phases", default=None)
+
+
+@contextmanager
+def phase(name):
+    """Adds the time spent in the block to the current request's phase breakdown"""
+    phases = current_phases.get()
+    if phases is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+
+def timed_iter(name, iterable):
+    """Yields from iterable, adding the time spent producing each item to phase name.
+    For bodies generated while the response is sent, after the view has returned."""
+    phases = current_phases.get()
+    if phases is None:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        finally:
+            phases[name] = phases.get(name, 0.0) + (time.perf_counter() - start) * 1000
+        yield item
+
+
+def collapse_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Profiler:
+    """Opt-in stack sampler plus slow request capture.
+
+    Every request gets a per-phase timing breakdown (see phase()), requests slower
+    than slow_ms are kept in a ring buffer. While sampling is enabled a background
+    thread records the stack of every thread serving a matching request every
+    interval seconds. Stacks are kept in collapsed form ("a;b;c count"), which
+    flamegraph.pl and speedscope read directly. Streamed responses are timed when
+    they close, so their duration includes generating the body.
+
+    Everything here is per process: enabling sampling, the stacks and the slow
+    requests only cover the gunicorn worker that served the admin request."""
+
+    def __init__(self, slow_ms=1000, interval=0.005, max_slow=100):
+        self.slow_ms = slow_ms
+        self.interval = interval
+        self.slow_requests = deque(maxlen=max_slow)
+        self.stacks = Counter()
+        self.active = {}
+        self.route = None
+        self.until = 0.0
+        self.sampler = None
+        self.lock = threading.Lock()
+
+    @property
+    def sampling(self):
+        return time.monotonic() < self.until
+
+    def enable(self, seconds, route=None):
+        with self.lock:
+            self.until = time.monotonic() + seconds
+            self.route = route
+            self.stacks = Counter()
+            if self.sampler is None or not self.sampler.is_alive():
+                self.sampler = threading.Thread(target=self._sample_loop, daemon=True)
+                self.sampler.start()
+
+    def disable(self):
+        self.until = 0.0
+
+    def _sample_loop(self):
+        own_ident = threading.get_ident()
+        while self.sampling:
+            frames = sys._current_frames()
+            with self.lock:
+                for ident, record in self.active.items():
+                    frame = frames.get(ident)
+                    if ident == own_ident or frame is None:
+                        continue
+                    stack = collapse_stack(frame)
+                    self.stacks[stack] += 1
+                    record["stacks"][stack] += 1
+            time.sleep(self.interval)
+
+    def start_request(self):
+        g.profile_start = time.perf_counter()
+        g.profile_phases = {}
+        current_phases.set(g.profile_phases)
+        if self.sampling and (self.route is None or self.route == request.endpoint):
+            with self.lock:
+                self.active[threading.get_ident()] = {"stacks": Counter()}
+
+    def finish_request(self, response):
+        start = g.pop("profile_start", None)
+        if start is None:
+            return response
+        details = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+        }
+        phases = g.get("profile_phases", {})
+        ident = threading.get_ident()
+        if response.is_streamed:
+            # The body is generated while it's sent, finish timing once it's closed
+            g.profile_streaming = True
+            response.call_on_close(lambda: self.record(start, details, phases, ident))
+        else:
+            self.record(start, details, phases, ident)
+        return response
+
+    def record(self, start, details, phases, ident):
+        duration_ms = (time.perf_counter() - start) * 1000
+        with self.lock:
+            record = self.active.pop(ident, None)
+        if duration_ms >= self.slow_ms:
+            self.slow_requests.append(
+                dict(
+                    details,
+                    time=time.time(),
+                    duration_ms=round(duration_ms, 2),
+                    phases_ms={name: round(ms, 2) for name, ms in phases.items()},
+                    other_ms=round(duration_ms - sum(phases.values()), 2),
+                    stacks=dict(record["stacks"]) if record else {},
+                )
+            )
+
+    def cleanup_request(self, exc=None):
+        # Also runs when the view raised and after_request was skipped
+        current_phases.set(None)
+        if g.get("profile_streaming"):
+            # Still sampled while the body is sent, record() stops that
+            return
+        with self.lock:
+            self.active.pop(threading.get_ident(), None)
+
+    def collapsed(self, stacks=None):
+        stacks = self.stacks if stacks is None else stacks
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(stacks.items()))
+
+
+def start_template_phase(sender, template, context, **extra):
+    g.profile_template_start = time.perf_counter()
+
+
+def finish_template_phase(sender, template, context, **extra):
+    start = g.pop("profile_template_start", None)
+    phases = current_phases.get()
+    if start is not None and phases is not None:
+        phases["template"] = phases.get("template", 0.0) + (time.perf_counter() - start) * 1000
+
+
+def register_profiling(app, profiler):
+    app.before_request(profiler.start_request)
+    app.after_request(profiler.finish_request)
+    app.teardown_request(profiler.cleanup_request)
+    before_render_template.connect(start_template_phase, app)
+    template_rendered.connect(finish_template_phase, app)
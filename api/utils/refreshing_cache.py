@@ -0,0 +1,72 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RefreshingCache:
+    """Keeps one value per key, built by load(key) on first use and rebuilt in the
+    background once older than max_age seconds. Callers keep getting the previous
+    value while it rebuilds. Values with a truthy `stale` attribute are rebuilt on
+    every access until a fresh one loads. load raises on failure. With max_entries
+    set, the least recently used keys are dropped past that many."""
+
+    def __init__(self, load, max_age=3600, max_entries=None):
+        self.load = load
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self.values = OrderedDict()
+        self.built_at = {}
+        self.refreshing = set()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        value = self.values.get(key)
+        if value is None:
+            return self.build(key)
+        if self.max_entries:
+            with self.lock:
+                if key in self.values:
+                    self.values.move_to_end(key)
+        if getattr(value, "stale", False) or time.monotonic() - self.built_at.get(key, 0) > self.max_age:
+            self.refresh_in_background(key)
+        return value
+
+    def peek(self, key):
+        """Returns the cached value without loading or refreshing it"""
+        return self.values.get(key)
+
+    def items(self):
+        with self.lock:
+            return list(self.values.items())
+
+    def put(self, key, value):
+        with self.lock:
+            self.values[key] = value
+            self.values.move_to_end(key)
+            self.built_at[key] = time.monotonic()
+            while self.max_entries and len(self.values) > self.max_entries:
+                evicted, _ = self.values.popitem(last=False)
+                self.built_at.pop(evicted, None)
+
+    def build(self, key):
+        value = self.load(key)
+        self.put(key, value)
+        return value
+
+    def refresh_in_background(self, key):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+
+        def refresh():
+            try:
+                self.build(key)
+            except Exception:
+                # Keep serving the previous value, the next request retries
+                pass
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
@@ -0,0 +1,39 @@
+import os
+import tempfile
+
+from flask import Response, current_app, get_flashed_messages, render_template, stream_with_context
+from jinja2 import FileSystemBytecodeCache
+
+from .profiling import timed_iter
+from .tracing import span
+
+
+def register_template_cache(app):
+    """Stores compiled templates on disk so cold workers skip recompiling them"""
+    cache_dir = os.environ.get("TEMPLATE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "jumpstart-jinja-cache"))
+    os.makedirs(cache_dir, exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    app.config.setdefault("STREAM_LISTINGS", os.environ.get("STREAM_LISTINGS", "1") == "1")
+    app.config.setdefault("STREAM_BUFFER_SIZE", int(os.environ.get("STREAM_BUFFER_SIZE", "50")))
+
+
+def warm_template_cache(app):
+    # Loads every template once, from the bytecode cache when it's there
+    for name in app.jinja_env.list_templates(extensions=["html"]):
+        app.jinja_env.get_template(name)
+
+
+def render_listing(template_name, **context):
+    """Renders a listing page, streaming it in chunks when STREAM_LISTINGS is on"""
+    app = current_app._get_current_object()  # type: ignore
+    if not app.config["STREAM_LISTINGS"]:
+        return render_template(template_name, **context)
+    # Consume flashed messages now, the session is saved before the body is sent
+    get_flashed_messages()
+    app.update_template_context(context)
+    # Only covers loading the template, the body is rendered while it is sent
+    with span("stream_template", template=template_name):
+        stream = app.jinja_env.get_template(template_name).stream(context)
+        stream.enable_buffering(app.config["STREAM_BUFFER_SIZE"])
+    # No template_rendered signal fires for a stream, time the chunks as they're rendered
+    return Response(stream_with_context(timed_iter("template", stream)), mimetype="text/html")
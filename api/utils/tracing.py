@@ -0,0 +1,203 @@
+import contextvars
+import json
+import re
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from flask import before_render_template, g, request, template_rendered
+
+current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+
+class Span:
+    def __init__(self, trace, name, parent_id=None, **attrs):
+        self.trace = trace
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attrs = attrs
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+        trace.spans.append(self)
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        if self.duration_ms is None:
+            self.duration_ms = (time.perf_counter() - self._start) * 1000
+
+    @property
+    def end(self):
+        return self.start + (self.duration_ms or 0) / 1000
+
+    def to_dict(self):
+        return {
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration_ms or 0, 3),
+            "attrs": self.attrs,
+        }
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id or secrets.token_hex(16)
+        self.spans = []
+
+    def to_dict(self):
+        root = self.spans[0]
+        return {
+            "trace_id": self.trace_id,
+            "name": root.name,
+            "start": root.start,
+            "duration_ms": round(root.duration_ms or 0, 3),
+            "attrs": root.attrs,
+            "spans": [span.to_dict() for span in self.spans],
+            "critical_path": [span.span_id for span in critical_path(root, self.spans)],
+        }
+
+
+def critical_path(root, spans):
+    """Spans that determined root's end time: walking back from the end, the child that
+    finished last, then the child that finished last before that one started, and so on"""
+    children = [span for span in spans if span.parent_id == root.span_id and span.duration_ms is not None]
+    path = [root]
+    cutoff = root.end
+    for child in sorted(children, key=lambda span: span.end, reverse=True):
+        if child.end <= cutoff:
+            path.extend(critical_path(child, spans))
+            cutoff = child.start
+    return path
+
+
+@contextmanager
+def span(name, **attrs):
+    """Records the block as a child of the current span. Does nothing outside a trace"""
+    parent = current_span.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, **attrs)
+    token = current_span.set(child)
+    try:
+        yield child
+    except Exception as e:
+        child.set(error=type(e).__name__)
+        raise
+    finally:
+        child.finish()
+        current_span.reset(token)
+
+
+def trace_headers():
+    """W3C traceparent header continuing the current trace, for upstream calls"""
+    parent = current_span.get()
+    if parent is None:
+        return {}
+    return {"traceparent": f"00-{parent.trace.trace_id}-{parent.span_id}-01"}
+
+
+class Tracer:
+    """Opens a trace per request and keeps the finished ones in a ring buffer.
+
+    Requests that arrive with a traceparent header join that trace. When `path` is
+    set every finished trace is also appended to it as a JSON line."""
+
+    def __init__(self, max_traces=500, path=None):
+        self.traces = deque(maxlen=max_traces)
+        self.path = path
+        self.lock = threading.Lock()
+        self.file_lock = threading.Lock()
+
+    def start_request(self):
+        match = TRACEPARENT.match(request.headers.get("traceparent", ""))
+        trace = Trace(match.group(1) if match else None)
+        root = Span(trace, request.endpoint or "unknown", match.group(2) if match else None,
+                    method=request.method, path=request.path)
+        g.trace_root = root
+        current_span.set(root)
+
+    def finish_request(self, response):
+        root = g.get("trace_root")
+        if root is not None:
+            root.set(status=response.status_code)
+            response.headers["X-Trace-Id"] = root.trace.trace_id
+        return response
+
+    def cleanup_request(self, exc=None):
+        # Runs after a streamed body has been sent, so the root covers the whole response
+        current_span.set(None)
+        root = g.pop("trace_root", None)
+        if root is None:
+            return
+        root.finish()
+        if exc is not None:
+            root.set(error=type(exc).__name__)
+        self.record(root.trace)
+
+    def record(self, trace):
+        with self.lock:
+            self.traces.append(trace)
+        if self.path:
+            line = json.dumps(trace.to_dict(), default=str) + "\n"
+            with self.file_lock, open(self.path, "a") as f:
+                f.write(line)
+
+    def recent(self):
+        """Newest first. A copy, request threads keep appending while it's read"""
+        with self.lock:
+            traces = list(self.traces)
+        traces.reverse()
+        return traces
+
+    def find(self, trace_id):
+        for trace in self.recent():
+            if trace.trace_id == trace_id:
+                return trace
+        return None
+
+    def query(self, endpoint=None, min_ms=0.0, limit=50):
+        """Most recent traces first"""
+        found = []
+        for trace in self.recent():
+            root = trace.spans[0]
+            if endpoint and root.name != endpoint:
+                continue
+            if (root.duration_ms or 0) < min_ms:
+                continue
+            found.append(trace)
+            if len(found) >= limit:
+                break
+        return found
+
+
+def start_template_span(sender, template, context, **extra):
+    parent = current_span.get()
+    if parent is not None:
+        child = Span(parent.trace, "render_template", parent.span_id, template=template.name)
+        g.trace_template_span = (child, current_span.set(child))
+
+
+def finish_template_span(sender, template, context, **extra):
+    started = g.pop("trace_template_span", None)
+    if started is not None:
+        child, token = started
+        child.finish()
+        current_span.reset(token)
+
+
+def register_tracing(app, tracer):
+    app.before_request(tracer.start_request)
+    app.after_request(tracer.finish_request)
+    app.teardown_request(tracer.cleanup_request)
+    before_render_template.connect(start_template_span, app)
+    template_rendered.connect(finish_template_span, app)
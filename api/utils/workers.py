@@ -0,0 +1,8 @@
+import os
+
+DEFAULT_THREADS = 4
+
+
+def worker_threads():
+    """Threads per gunicorn worker, read by gunicorn.conf.py and used to size per-worker pools"""
+    return int(os.environ.get("GUNICORN_THREADS", DEFAULT_THREADS))
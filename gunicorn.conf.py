@@ -0,0 +1,66 @@
+# Gunicorn configuration for serving api.app:app in production.
+#
+# Run with:
+#   gunicorn -c gunicorn.conf.py api.app:app
+#
+# Concurrency knobs (all read from the environment):
+#   PORT                       port to bind on (default 5000)
+#   GUNICORN_WORKER_CLASS      "sync" (preforked, one request per process), "gthread"
+#                              (threads inside each process, the default) or "gevent"
+#                              (cooperative async workers, requires gevent to be installed)
+#   WEB_CONCURRENCY            number of worker processes (default 2 * CPUs + 1)
+#   GUNICORN_THREADS           threads per worker for gthread (default 4), also sizes the
+#                              gateway connection pool in api/auth.py (GATEWAY_POOL_SIZE overrides it)
+#   GUNICORN_WORKER_CONNECTIONS  max concurrent requests per gevent worker (default 1000)
+#   GUNICORN_TIMEOUT           seconds before a silent worker is killed and restarted (default 60)
+#   GUNICORN_GRACEFUL_TIMEOUT  seconds in-flight requests get to finish on reload/shutdown (default 30)
+#   GUNICORN_KEEPALIVE         seconds to hold idle keep-alive connections (default 5)
+#   GUNICORN_MAX_REQUESTS      recycle a worker after this many requests, 0 disables (default 1000)
+#   TEMPLATE_CACHE_DIR         directory for the shared Jinja bytecode cache (default <tmp>/jumpstart-jinja-cache)
+#   STREAM_LISTINGS            "1" streams event listings in chunks of STREAM_BUFFER_SIZE template writes
+#   WAITING_ROOM_PATH          SQLite file holding checkout admissions, shared by the workers so
+#                              WAITING_ROOM_CAPACITY applies per host rather than per worker
+#   PURCHASE_CONFIRMATION      "sync" (default) or "async": purchases are queued in PURCHASE_QUEUE_PATH and
+#                              every worker flushes PURCHASE_BATCH_SIZE of them each PURCHASE_FLUSH_INTERVAL seconds
+#
+# Graceful reload: send SIGHUP to the master process (kill -HUP <pid>). New workers are
+# started with the new code and config and old workers finish their in-flight requests
+# within GUNICORN_GRACEFUL_TIMEOUT before exiting.
+import multiprocessing
+import os
+
+from api.utils.workers import worker_threads
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count() * 2 + 1))
+threads = worker_threads()
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "1000"))
+
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", "5"))
+
+# Recycle workers periodically, with jitter so they don't all restart at once
+max_requests = int(os.environ.get("GUNICORN_MAX_REQUESTS", "1000"))
+max_requests_jitter = max_requests // 10
+
+accesslog = "-"
+errorlog = "-"
+
+
+def post_worker_init(worker):
+    # Warm the gateway token so /readyz passes before the first real request
+    from api.app import PURCHASE_CONFIRMATION, app, purchase_queue
+    from api.auth import get_token
+    from api.utils.templating import warm_template_cache
+
+    warm_template_cache(app)
+    if PURCHASE_CONFIRMATION == "async":
+        # Picks up purchases left pending by a worker that exited before flushing them
+        purchase_queue.start()
+    try:
+        get_token()
+    except Exception as e:
+        worker.log.warning(f"Could not warm gateway token: {e}")